@@ -0,0 +1,204 @@
+#!/usr/bin/env sage
+from sage.all import *
+import argparse
+import json
+import platform
+import sys
+import time
+from itertools import product
+from math import ceil
+from random import Random
+from statistics import median
+from typing import Callable, List
+from cdp import CDP, CDPTransformation, facet_is_at_height_one, generate_cdp_from_polytope
+from piecewise_affine_function import AffineFunction, PiecewiseAffineFunction
+from polytope import facet_heights
+
+
+def random_base(rng: Random, dim: int, vertices: int, bound: int) -> Polyhedron:
+    """
+    Lattice polytope with the origin in the interior: convex hull of +-e_i and of random points
+    of [-bound, bound]^dim. The number of its vertices grows with the number of random points.
+    """
+    points = [[s * int(i == j) for j in range(dim)] for i in range(dim) for s in [1, -1]]
+    points += [[rng.randint(-bound, bound) for _ in range(dim)] for _ in range(vertices)]
+    return Polyhedron(vertices=points)
+
+
+def random_psi(rng: Random, base: Polyhedron, pieces: int, bound: int) -> PiecewiseAffineFunction:
+    """Concave function on the base - minimum of at most pieces random affine functions"""
+    dim = base.dim()
+    functions = {tuple([rng.randint(0, bound)] + [rng.randint(-bound, bound) for _ in range(dim)])
+                 for _ in range(pieces)}
+    # Affine functions with equal linear parts do not define different pieces
+    functions = list({f[1:]: f for f in sorted(functions)}.values())
+    affine_pieces = []
+    for f in functions:
+        ieqs = [[b - a for a, b in zip(f, g)] for g in functions if g != f]
+        domain = base.intersection(Polyhedron(ieqs=ieqs)) if ieqs else base
+        if domain.dim() == dim:
+            affine_pieces.append(AffineFunction(list(f), domain))
+    return PiecewiseAffineFunction(affine_pieces)
+
+
+def random_cdp(rng: Random, dim: int, vertices: int, pieces: int, psi: int, bound: int = 2):
+    """
+    Random CDP together with its base and psi list, validation of the CDP is left to the caller.
+    The first psi is translated so that the sum of psi is non negative on all domain vertices.
+    """
+    base = random_base(rng, dim, vertices, bound)
+    psi_list = [random_psi(rng, base, pieces, bound) for _ in range(psi)]
+    points = [vert for vert in base.vertices_list()] + \
+             [list(vert) for f in psi_list for vert in f.vertices.tolist()]
+    sums = [sum(v) for v in zip(*[f.values(points)[0] for f in psi_list])]
+    shift = max(0, ceil(-min(sums)))
+    psi_list[0] = psi_list[0].translated(shift)
+    return CDP(psi_list, base, validate=False), psi_list, base
+
+
+def random_unimodular(rng: Random, dim: int) -> Matrix:
+    M = identity_matrix(ZZ, dim)
+    for _ in range(3 * dim):
+        i, j = rng.sample(range(dim), 2) if dim > 1 else (0, 0)
+        if i != j:
+            M.add_multiple_of_row(i, j, rng.choice([-1, 1]))
+    for i in range(dim):
+        if rng.random() < 0.5:
+            M.rescale_row(i, -1)
+    return M
+
+
+def fano_polytope(rng: Random, dim: int) -> Polyhedron:
+    """
+    Cross-polytope mapped by a random unimodular map: a Fano polytope, so that is_fano of its CDP
+    goes through all the checks
+    """
+    M = random_unimodular(rng, dim)
+    return Polyhedron(vertices=[list(M * vector(ZZ, [s * int(i == j) for j in range(dim)]))
+                                for i in range(dim) for s in [1, -1]])
+
+
+def equivalent_copy(rng: Random, cdp: CDP, bound: int = 2) -> CDP:
+    """Image of the CDP under a random unimodular map, translation and shear"""
+    m = len(cdp.psi_list)
+    transformation = CDPTransformation(cdp.n, m)
+    transformation.transform_base(linear_transformation(random_unimodular(rng, cdp.n).transpose()))
+    alpha = [rng.randint(-bound, bound) for _ in range(m - 1)]
+    beta = [rng.randint(-bound, bound) for _ in range(m - 1)]
+    transformation.translate(alpha + [-sum(alpha)])
+    transformation.shear(beta + [-sum(beta)], [rng.randint(-bound, bound) for _ in range(cdp.n)])
+    return cdp.transformed(transformation)
+
+
+def perturbed_copy(rng: Random, cdp: CDP) -> CDP:
+    """
+    Equivalent copy with doubled first psi: bases and domains still match, so equal has to go
+    through the whole search. It is not equivalent to the CDP unless the first psi is affine.
+    """
+    other = equivalent_copy(rng, cdp)
+    psi = other.psi_list[0]
+    other.psi_list[0] = PiecewiseAffineFunction.from_arrays(psi.coefs * 2, psi.vertices, psi.vertex_offsets,
+                                                            psi.inequalities, psi.inequality_offsets)
+    return other
+
+
+def measure(fn: Callable, repeat: int):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def _record(name: str, params: dict, times: List[float], result=None) -> dict:
+    record = {'name': name, 'params': params, 'repeat': len(times), 'times': times,
+              'min': min(times), 'median': median(times)}
+    if result is not None:
+        record['result'] = result
+    return record
+
+
+def run_workload(dim: int, vertices: int, pieces: int, psi: int, repeat: int = 3, seed: int = 0) -> List[dict]:
+    """Time every benchmarked operation on one random workload"""
+    rng = Random(seed)
+    cdp, psi_list, base = random_cdp(rng, dim, vertices, pieces, psi)
+    params = {'dim': dim, 'vertices': vertices, 'pieces': pieces, 'psi': psi, 'seed': seed,
+              'base_vertices': cdp.k, 'total_pieces': sum(len(f) for f in psi_list)}
+    records = []
+
+    _, times = measure(lambda: CDP(psi_list, base), repeat)
+    records.append(_record('validate', params, times))
+
+    poly = random_base(rng, dim + 1, vertices, 2)
+    _, times = measure(lambda: generate_cdp_from_polytope(poly), repeat)
+    records.append(_record('generate', params, times))
+
+    facets = [[list(v.vector()) for v in facet.vertices()] for facet in poly.facets()]
+    _, times = measure(lambda: [facet_is_at_height_one(facet) for facet in facets], repeat)
+    records.append(_record('facet_is_at_height_one', dict(params, facets=len(facets)), times))
+    _, times = measure(lambda: facet_heights(poly), repeat)
+    records.append(_record('facet_heights', dict(params, facets=len(facets)), times))
+
+    fano_cdp = generate_cdp_from_polytope(fano_polytope(rng, dim + 1))
+    fano, times = measure(fano_cdp.is_fano, repeat)
+    records.append(_record('is_fano', dict(params, polytope_vertices=2 * (dim + 1)), times, fano))
+
+    equivalent = equivalent_copy(rng, cdp)
+    result, times = measure(lambda: cdp.equal(equivalent), repeat)
+    records.append(_record('equal_equivalent', params, times, result))
+
+    perturbed = perturbed_copy(rng, cdp)
+    result, times = measure(lambda: cdp.equal(perturbed), repeat)
+    records.append(_record('equal_non_equivalent', params, times, result))
+
+    f = psi_list[0]
+    points = [list(v) for v in f.vertices.tolist()]
+    _, times = measure(lambda: [f.value(x) for x in points], repeat)
+    records.append(_record('value', dict(params, points=len(points)), times))
+    return records
+
+
+def run(dims, vertices, pieces, psi, repeat: int = 3, seed: int = 0) -> dict:
+    results = []
+    for params in product(dims, vertices, pieces, psi):
+        results.extend(run_workload(*params, repeat=repeat, seed=seed))
+    meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+            'platform': platform.platform(), 'repeat': repeat, 'seed': seed}
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline: dict, current: dict) -> List[tuple]:
+    """(name, params, baseline median, current median, ratio) for benchmarks present in both runs"""
+    def key(record):
+        return record['name'], json.dumps(record['params'], sort_keys=True)
+    old = {key(record): record for record in baseline['results']}
+    rows = []
+    for record in current['results']:
+        if key(record) in old:
+            before = old[key(record)]['median']
+            rows.append((record['name'], record['params'], before, record['median'],
+                         record['median'] / before if before else float('inf')))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time CDP operations on synthetic workloads')
+    parser.add_argument('output', help='JSON file for the results')
+    parser.add_argument('--dims', type=int, nargs='+', default=[2, 3])
+    parser.add_argument('--vertices', type=int, nargs='+', default=[4, 8])
+    parser.add_argument('--pieces', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--psi', type=int, nargs='+', default=[2, 3])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    args = parser.parse_args()
+    report = run(args.dims, args.vertices, args.pieces, args.psi, args.repeat, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1, default=str)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for name, params, before, after, ratio in compare(baseline, report):
+            print(f'{name:24} {json.dumps(params)} {before:.4g}s -> {after:.4g}s x{ratio:.2f}')
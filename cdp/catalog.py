@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+import json
+from fractions import Fraction
+from typing import Iterable, List
+import numpy as np
+from cdp import CDP
+from piecewise_affine_function import PiecewiseAffineFunction, exact_array
+from polytope import polytope, to_fraction, primitive
+
+# File layout: MAGIC, 8 bytes of little-endian header length, JSON header with dtype, shape and
+# offset of every array, then the arrays themselves aligned to ALIGNMENT bytes
+MAGIC = b'CDPCAT2\n'
+ALIGNMENT = 64
+
+# Rational numbers are stored as pairs of flat int64 arrays of numerators and denominators.
+# Offsets count numbers, not rows: row width is n for vertices and n + 1 for coefficients and inequalities
+#   dims                (cdps,)         n of every CDP
+#   base_offsets        (cdps + 1,)     into base_num / base_den
+#   psi_offsets         (cdps + 1,)     into the table of psi
+#   piece_offsets       (psi + 1,)      into the table of pieces
+#   coef_offsets        (pieces + 1,)   into coef_num / coef_den
+#   vertex_offsets      (pieces + 1,)   into vertex_num / vertex_den
+#   inequality_offsets  (pieces + 1,)   into inequalities, rows are scaled to primitive integer rows
+#   invariant_offsets   (cdps + 1,)     into invariant_bytes, uint8 JSON of CDP.invariants() with lists
+#                                       for tuples and strings for fractions
+ARRAYS = ['dims', 'base_offsets', 'psi_offsets', 'piece_offsets', 'coef_offsets', 'vertex_offsets',
+          'inequality_offsets', 'invariant_offsets', 'base_num', 'base_den', 'coef_num', 'coef_den',
+          'vertex_num', 'vertex_den', 'inequalities', 'invariant_bytes']
+DTYPES = {'invariant_bytes': '<u1'}
+
+
+def _aligned(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _rational_parts(values) -> (List[int], List[int]):
+    numbers = [to_fraction(x) for x in values]
+    return [x.numerator for x in numbers], [x.denominator for x in numbers]
+
+
+def _rational_array(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    if np.all(den == 1):
+        return num
+    return exact_array([Fraction(int(p), int(q)) for p, q in zip(num, den)])
+
+
+def _json_number(x):
+    if isinstance(x, Fraction) and x.denominator != 1:
+        return str(x)
+    return int(x)
+
+
+def _from_json(value):
+    if isinstance(value, list):
+        return tuple(_from_json(x) for x in value)
+    if isinstance(value, str):
+        return Fraction(value)
+    return value
+
+
+def write_catalog(path: str, cdps: Iterable[CDP]) -> int:
+    """Write CDPs to one file of flat integer arrays, returns the number of written CDPs"""
+    data = {name: [] for name in ARRAYS}
+    for name in ['base_offsets', 'psi_offsets', 'piece_offsets', 'coef_offsets', 'vertex_offsets',
+                 'inequality_offsets', 'invariant_offsets']:
+        data[name].append(0)
+
+    def extend(name, values, offsets=None):
+        data[name].extend(values)
+        if offsets is not None:
+            data[offsets].append(len(data[name]))
+
+    for cdp in cdps:
+        data['dims'].append(cdp.n)
+        num, den = _rational_parts(x for vert in cdp.base.vertices_list() for x in vert)
+        extend('base_num', num, 'base_offsets')
+        extend('base_den', den)
+        invariants = json.dumps(cdp.invariants(), default=_json_number, separators=(',', ':'))
+        extend('invariant_bytes', invariants.encode(), 'invariant_offsets')
+        for psi in cdp.psi_list:
+            for i in range(len(psi)):
+                num, den = _rational_parts(psi.coefs[i])
+                extend('coef_num', num, 'coef_offsets')
+                extend('coef_den', den)
+                num, den = _rational_parts(psi.piece_vertices(i).flat)
+                extend('vertex_num', num, 'vertex_offsets')
+                extend('vertex_den', den)
+                # Rows may be rational after a base transformation, positive multiples define
+                # the same inequalities
+                rows = [primitive([to_fraction(x) for x in row]) for row in psi.piece_inequalities(i)]
+                extend('inequalities', [x for row in rows for x in row], 'inequality_offsets')
+            data['piece_offsets'].append(data['piece_offsets'][-1] + len(psi))
+        data['psi_offsets'].append(len(data['piece_offsets']) - 1)
+
+    header, arrays, position = {}, {}, 0
+    for name in ARRAYS:
+        arr = np.array(data[name], dtype=DTYPES.get(name, '<i8'))
+        arrays[name] = arr
+        header[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': position}
+        position += _aligned(arr.nbytes)
+    header_bytes = json.dumps(header).encode()
+    start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name in ARRAYS:
+            f.seek(start + header[name]['offset'])
+            f.write(arrays[name].tobytes())
+        f.truncate(start + position)
+    return len(data['dims'])
+
+
+class CatalogReader:
+    """
+    Memory-mapped catalog: nothing is read from the file until it is needed, CDPs are built
+    on index access. Base vertices, numbers of pieces and invariants are available without
+    building a CDP.
+    """
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a CDP catalog')
+            size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(size))
+        start = _aligned(len(MAGIC) + 8 + size)
+        for name in ARRAYS:
+            spec = header[name]
+            if spec['shape'][0] == 0:
+                # empty files and regions can not be mapped
+                arr = np.zeros(spec['shape'], dtype=spec['dtype'])
+            else:
+                arr = np.memmap(path, dtype=spec['dtype'], mode='r', offset=start + spec['offset'],
+                                shape=tuple(spec['shape']))
+            setattr(self, name, arr)
+
+    def __len__(self):
+        return len(self.dims)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def base_vertices(self, i: int) -> np.ndarray:
+        n = int(self.dims[i])
+        begin, end = self.base_offsets[i], self.base_offsets[i + 1]
+        return _rational_array(self.base_num[begin:end], self.base_den[begin:end]).reshape(-1, n)
+
+    def psi_sizes(self, i: int) -> List[int]:
+        """Numbers of pieces of every psi of i-th CDP"""
+        pieces = self.piece_offsets[self.psi_offsets[i]:self.psi_offsets[i + 1] + 1]
+        return [int(x) for x in np.diff(pieces)]
+
+    def invariants(self, i: int) -> tuple:
+        """CDP.invariants() of i-th CDP as they were computed on writing"""
+        begin, end = self.invariant_offsets[i], self.invariant_offsets[i + 1]
+        return _from_json(json.loads(self.invariant_bytes[begin:end].tobytes()))
+
+    def _psi(self, j: int, n: int) -> PiecewiseAffineFunction:
+        first, last = self.piece_offsets[j], self.piece_offsets[j + 1]
+        coefs = self.coef_offsets[first:last + 1]
+        coefs = _rational_array(self.coef_num[coefs[0]:coefs[-1]], self.coef_den[coefs[0]:coefs[-1]])
+        vertices = self.vertex_offsets[first:last + 1]
+        inequalities = self.inequality_offsets[first:last + 1]
+        return PiecewiseAffineFunction.from_arrays(
+            np.array(coefs, dtype=object).reshape(-1, n + 1),
+            _rational_array(self.vertex_num[vertices[0]:vertices[-1]],
+                            self.vertex_den[vertices[0]:vertices[-1]]).reshape(-1, n),
+            (vertices - vertices[0]) // n,
+            np.asarray(self.inequalities[inequalities[0]:inequalities[-1]]).reshape(-1, n + 1),
+            (inequalities - inequalities[0]) // (n + 1))
+
+    def __getitem__(self, i: int) -> CDP:
+        if not -len(self) <= i < len(self):
+            raise IndexError('catalog index out of range')
+        i %= len(self)
+        n = int(self.dims[i])
+        psi_list = [self._psi(j, n) for j in range(self.psi_offsets[i], self.psi_offsets[i + 1])]
+        return CDP(psi_list, polytope(self.base_vertices(i).tolist()), validate=False)
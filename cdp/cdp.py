@@ -1,55 +1,144 @@
-#!/usr/bin/env sage
-from sage.all import *
+#!/usr/bin/env python
 from typing import List
-from piecewise_affine_function import PiecewiseAffineFunction, AffineFunction
+from piecewise_affine_function import PiecewiseAffineFunction, AffineFunction, exact_array, \
+    h_representation, unique_rows
+from polytope import polytope, same_polytope, facet_vertex_sets, adjacency_map, \
+    exact_number, to_fraction, independent_rows, inverse, determinant, f_vector, \
+    normalized_volume, lattice_points_count, lattice_heights, nullspace, sage_available
 from collections import defaultdict
-from itertools import permutations
+from copy import copy
+from fractions import Fraction
+from functools import lru_cache
+from hashlib import sha256
+from itertools import islice
+from math import floor
+from multiprocessing import Pool
+from numbers import Integral
+from queue import Queue
+from time import perf_counter
+import json
 import numpy as np
-from sympy.matrices import Matrix
-from sympy import Rational, lcm
+
+
+class EqualStats:
+    """
+    Counters and timers of the stages of CDP.equal, collected only when an instance is passed
+    as stats. With workers > 1 matching runs in other processes and only the search of base
+    maps is accounted.
+    counts:
+        invariants_rejected - pairs rejected by invariants
+        vertex_maps - bijections of base vertices preserving facets
+        incidence_pruned - branches of the bijection search cut by facet incidence
+        non_unimodular - bijections which are not given by a unimodular map
+        lattice_maps - maps found by the search
+        automorphisms - maps obtained from the first one by the automorphisms of the base
+        class_splits_failed - maps under which domains of psi do not match
+        shifts_nonzero - maps under which translation constants or shear vectors can not sum to 0
+        pairs_rejected - psi which can not be translated and sheared into any other psi left
+        mappings - psi mappings found
+    times, seconds: invariants, base_combinatorics - face lattices of the bases, vertex_maps, solve,
+    automorphisms, transform, classes, mappings.
+    """
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.times = defaultdict(float)
+
+    def add_time(self, stage: str, start: float):
+        self.times[stage] += perf_counter() - start
+
+    def __str__(self):
+        counts = ', '.join(f'{name}: {value}' for name, value in sorted(self.counts.items()))
+        times = ', '.join(f'{name}: {value:.4f}s' for name, value in sorted(self.times.items()))
+        return f'EqualStats({counts}; {times})'
+
+
+class CDPTransformation:
+    """
+    Chain of base transformations, translations and shears recorded as one action on CDPs of
+    m functions in dimension n: the base is mapped by matrix (acting on columns) and psi_i
+    is replaced with u -> psi_i(matrix^-1 u) + alphas[i] + <u, shears[i]>.
+    Operations are only composed here, CDP.transformed applies the result once.
+    """
+    def __init__(self, n: int, m: int):
+        self.n = n
+        self.m = m
+        self.matrix = np.identity(n, dtype=np.int64)
+        self.matrix_inverse = np.identity(n, dtype=np.int64)
+        self.alphas = [0] * m
+        self.shears = exact_array(np.zeros((m, n), dtype=np.int64))
+
+    def transform_base(self, phi):
+        """Same as CDP.transform_base"""
+        M, inv = _phi_matrices(phi)
+        if M.shape != (self.n, self.n):
+            raise ValueError(f'Wrong dimension of phi: {len(M)}, should be {self.n}')
+        self.matrix = exact_array(np.matmul(M, self.matrix))
+        self.matrix_inverse = exact_array(np.matmul(self.matrix_inverse, inv))
+        # <phi^-1 u, w> = <u, phi^-T w>
+        self.shears = exact_array(np.matmul(self.shears, inv))
+
+    def translate(self, alpha_list: List[int]):
+        _check_translation(alpha_list, self.m)
+        self.alphas = [alpha + exact_number(a) for alpha, a in zip(self.alphas, alpha_list)]
+
+    def shear(self, beta_list: List[int], v: List[int]):
+        _check_shear(beta_list, v, self.m, self.n)
+        v = [exact_number(x) for x in v]
+        self.shears = exact_array(self.shears + np.array([[exact_number(beta) * x for x in v]
+                                                          for beta in beta_list], dtype=object))
+
+    def then(self, other):
+        """Transformation applying self and then other"""
+        if (other.n, other.m) != (self.n, self.m):
+            raise ValueError('Transformations act on CDPs of different sizes')
+        result = CDPTransformation(self.n, self.m)
+        result.matrix = exact_array(np.matmul(other.matrix, self.matrix))
+        result.matrix_inverse = exact_array(np.matmul(self.matrix_inverse, other.matrix_inverse))
+        result.alphas = [a + b for a, b in zip(self.alphas, other.alphas)]
+        result.shears = exact_array(np.matmul(self.shears, other.matrix_inverse) + other.shears)
+        return result
+
+    def inverse(self):
+        result = CDPTransformation(self.n, self.m)
+        result.matrix, result.matrix_inverse = self.matrix_inverse, self.matrix
+        result.alphas = [-a for a in self.alphas]
+        result.shears = exact_array(-np.matmul(self.shears, self.matrix))
+        return result
 
 
 class CDP:
-    def __init__(self, psi_list: List[PiecewiseAffineFunction], base: Polyhedron):
-        # Check that sum of psi is non negative on borders of domains
-        # (check polytop vertices of domains laying inside of function scope)
-        for psi in psi_list:
-            for piece in psi.affine_pieces:
-                for vert in piece.domain.vertices():
-                    if vert in base:
-                        try:
-                            s = sum([ps.value(vert.vector()) for ps in psi_list])
-                        except ValueError:
-                            continue
-                        else:
-                            if s < 0:
-                                raise ValueError(
-                                    f'Not a valid CDP - sum of psi is {s} on {vert}')
-        # Check that sum of psi is non negative on base vertices
-        for vert in base.vertices():
-            try:
-                s = sum([ps.value(vert) for ps in psi_list])
-            except ValueError:
-                raise ValueError('Not a valid CDP: psi is not defined on base')
-            else:
-                if s < 0:
-                    raise ValueError(
-                        f'Not a valid CDP - sum of psi is {s} on {vert}')
+    def __init__(self, psi_list: List[PiecewiseAffineFunction], base, validate: bool = True):
+        # base is a polytope of any backend, see polytope.py
+        if validate:
+            _check_valid(psi_list, base)
         self.psi_list = psi_list
         self.base = base
-        self.n = len(self.base.vertices()[0].vector())
-        self.k = len(self.base.vertices())
+        vertices = self.base.vertices_list()
+        self.n = len(vertices[0])
+        self.k = len(vertices)
         self.base_adjacency_map = defaultdict(set)
+        self._facets = None
+        self._invariants = None
 
     def __str__(self):
         psi_str = "\n".join([str(psi) for psi in self.psi_list])
-        return f'CDP object, psi list: {psi_str},\nbase: {self.base.vertices()}'
+        return f'CDP object, psi list: {psi_str},\nbase: {self.base.vertices_list()}'
+
+    def save(self, path: str):
+        """Write the CDP to a one-entry catalog, see catalog.py"""
+        from catalog import write_catalog
+        write_catalog(path, [self])
+
+    @staticmethod
+    def load(path: str):
+        from catalog import CatalogReader
+        return CatalogReader(path)[0]
 
     def __eq__(self, other):
         """
         Note: the order of the functions in psi_list is not important for this implementation.
         """
-        if not self.base == other.base:
+        if not same_polytope(self.base, other.base):
             return False
         if not len(self.psi_list) == len(other.psi_list):
             return False
@@ -59,223 +148,704 @@ class CDP:
         return True
 
     def _build_adjacency_map(self):
-        for i in range(self.k):
-            for j in range(i + 1, self.k):
-                if self.base.vertices()[i].is_incident(self.base.vertices()[j]):
-                    self.base_adjacency_map[i].add(j)
-                    self.base_adjacency_map[j].add(i)
-
-    def transform_base(self, phi: linear_transformation):
-        vertices = []
-        for vert in self.base.vertices():
-            vertices.append(phi(vert.vector()))
-        self.base = Polyhedron(vertices=vertices)
-        try:
-            inv = phi.inverse().matrix()
-        except ZeroDivisionError:
-            raise ValueError(f'phi is not invertible')
-        inv = np.array([np.array(row) for row in inv])
-        for i in range(len(self.psi_list)):
-            self.psi_list[i].transform(phi, inv)
+        self.base_adjacency_map = adjacency_map(self.base)
+
+    def _base_facets(self):
+        """Facets of the base as sets of vertex indices"""
+        if self._facets is None:
+            self._facets = facet_vertex_sets(self.base)
+        return self._facets
+
+    def _vertex_maps(self, other_cdp, stats: EqualStats = None):
+        """Lazily generate bijections between base vertices which preserve the face lattice.
+        perm[i] is the index of the vertex of other_cdp.base the i-th vertex is mapped to.
+        """
+        if self.k != other_cdp.k:
+            return iter(())
+        if stats is not None:
+            start = perf_counter()
+        for cdp in (self, other_cdp):
+            if not cdp.base_adjacency_map:
+                cdp._build_adjacency_map()
+        facets, other_facets = self._base_facets(), other_cdp._base_facets()
+        if stats is not None:
+            stats.add_time('base_combinatorics', start)
+        return _vertex_bijections(self.k, facets, self.base_adjacency_map,
+                                  other_facets, other_cdp.base_adjacency_map, stats)
+
+    def transform_base(self, phi):
+        """
+        phi is a Sage linear transformation or an integer matrix acting on columns.
+        """
+        M, inv = _phi_matrices(phi)
+        vertices = np.matmul(exact_array(self.base.vertices_list()), M.T)
+        self.base = polytope(vertices.tolist())
+        self.base_adjacency_map = defaultdict(set)
+        self._facets = None
+        self._invariants = None
+        self.psi_list = [psi.transformed(M, inv) for psi in self.psi_list]
 
     def translate(self, alpha_list: List[int]):
-        if len(alpha_list) != len(self.psi_list):
-            raise ValueError(f'Length of alpha_list is {len(alpha_list)}, '
-                             f'should be {len(self.psi_list)}')
-        if sum(alpha_list) != 0:
-            raise ValueError('Sum of coefficients should be 0')
-        for idx, psi in enumerate(self.psi_list):
-            for piece in psi.affine_pieces:
-                piece.coefs[0] += alpha_list[idx]
+        self.psi_list = self._translated_psi_list(alpha_list)
 
     def shear(self, beta_list: List[int], v: List[int]):
-        if len(beta_list) != len(self.psi_list):
-            raise ValueError(f'Length of beta_list is {len(beta_list)}, '
-                             f'should be {len(self.psi_list)}')
-        if sum(beta_list) != 0:
-            raise ValueError('Sum of coefficients should be 0')
-        m = len(self.psi_list[0].affine_pieces[0].coefs) - 1
-        if len(v) != m:
-            raise ValueError(f'Wrong dimension of v: {len(v)}, should be {m}')
-        for idx, psi in enumerate(self.psi_list):
-            for piece in psi.affine_pieces:
-                for j, coef in enumerate(v):
-                    piece.coefs[j + 1] += coef * beta_list[idx]
-
-    def _vert_permutation_is_valid(self, perm):
-        """Check that vertices permutation saves incidence
+        self.psi_list = self._sheared_psi_list(beta_list, v)
+
+    def translated(self, alpha_list: List[int]):
+        """Translated CDP as a new object sharing the base and unchanged psi with self"""
+        return self._with_psi_list(self._translated_psi_list(alpha_list))
+
+    def sheared(self, beta_list: List[int], v: List[int]):
+        """Sheared CDP as a new object sharing the base and unchanged psi with self"""
+        return self._with_psi_list(self._sheared_psi_list(beta_list, v))
+
+    def _translated_psi_list(self, alpha_list: List[int]) -> List[PiecewiseAffineFunction]:
+        _check_translation(alpha_list, len(self.psi_list))
+        return [psi.translated(alpha) if alpha != 0 else psi for psi, alpha in zip(self.psi_list, alpha_list)]
+
+    def _sheared_psi_list(self, beta_list: List[int], v: List[int]) -> List[PiecewiseAffineFunction]:
+        _check_shear(beta_list, v, len(self.psi_list), self.psi_list[0].n)
+        return [psi.sheared([coef * beta for coef in v]) if beta != 0 else psi
+                for psi, beta in zip(self.psi_list, beta_list)]
+
+    def _with_psi_list(self, psi_list: List[PiecewiseAffineFunction]):
+        # Base, its face lattice and invariants do not depend on translations and shears
+        cdp = copy(self)
+        cdp.psi_list = psi_list
+        return cdp
+
+    def transformed(self, transformation):
         """
-        for vert, inc_list in self.base_adjacency_map.items():
-            for other_vert in inc_list:
-                if not perm[other_vert] in self.base_adjacency_map[perm[vert]]:
-                    return False
-        return True
+        New CDP obtained from self by a recorded CDPTransformation. The base and the psi are
+        transformed once, psi share offsets with the psi of self, self is not changed.
+        """
+        if transformation.n != self.n or transformation.m != len(self.psi_list):
+            raise ValueError(f'Transformation of {transformation.m} functions in dimension '
+                             f'{transformation.n} can not be applied to {len(self.psi_list)} '
+                             f'functions in dimension {self.n}')
+        M, inv = transformation.matrix, transformation.matrix_inverse
+        vertices = np.matmul(exact_array(self.base.vertices_list()), M.T)
+        psi_list = [psi.transformed(M, inv).translated(alpha).sheared(w)
+                    for psi, alpha, w in zip(self.psi_list, transformation.alphas, transformation.shears)]
+        return CDP(psi_list, polytope(vertices.tolist()), validate=False)
 
-    def _get_transform_matrix(self, points, point_images):
-        left = np.matmul(points.T, points)
-        try:
-            inverse = np.linalg.inv(left)
-        except np.linalg.LinAlgError:
-            raise ValueError(f'Base of the CDP should be non-degenerate '
-                             f'(dimension {self.n} is provided, but '
-                             'the real dimension is lower)')
-        A = np.matmul(np.matmul(point_images, points), inverse)
-        return A
-
-    def _domains_match(self, psi1: PiecewiseAffineFunction, psi2: PiecewiseAffineFunction) -> bool:
-        if len(psi1.affine_pieces) != len(psi2.affine_pieces):
-            return False
-        return set([p.domain for p in psi1.affine_pieces]) == set([p.domain for p in psi2.affine_pieces])
-
-    def _get_equivalence_classes(self, other_psi_list):
-        used = [False for _ in range(len(other_psi_list))]
-        classes = [[] for _ in range(len(self.psi_list))]
-        for i, psi1 in enumerate(self.psi_list):
-            for j, psi2 in enumerate(other_psi_list):
-                if self._domains_match(psi1, psi2):
-                    used[j] = True
-                    classes[i].append(j)
-        if len([c for c in classes if len(c) == 0]) > 0 or len([u for u in used if not u]) > 0:
+    def _get_equivalence_classes(self, other_psi_list, psi_list=None):
+        if psi_list is None:
+            psi_list = self.psi_list
+        # Psi with the same domains are grouped by one pass over the fingerprints
+        other_by_fingerprint = defaultdict(list)
+        for j, psi in enumerate(other_psi_list):
+            other_by_fingerprint[psi.fingerprint()].append(j)
+        fingerprints = [psi.fingerprint() for psi in psi_list]
+        classes = [other_by_fingerprint.get(fp, []) for fp in fingerprints]
+        if any(len(c) == 0 for c in classes) or not set(other_by_fingerprint) <= set(fingerprints):
             return False, []
         return True, classes
 
-    def _list_mappings(self, classes):
-        dicts_res = self._list_mappings_recursive(classes, dict(), idx=0)
-        res = []
-        for small_res in dicts_res:
-            res.append([0] * len(classes))
-            for k, v in small_res.items():
-                res[-1][v] = k
-        return res
-
-    def _list_mappings_recursive(self, classes, current_dict, idx=0):
-        res = []
-        for elem in classes[idx]:
-            if elem in current_dict:
+    def base_automorphisms(self) -> tuple:
+        """
+        Lattice automorphism group of the base: unimodular maps (int64 arrays acting on columns)
+        of the base onto itself, the identity first. Groups are cached by base vertices.
+        """
+        return _automorphisms(tuple(sorted(tuple(exact_number(x) for x in v)
+                                           for v in self.base.vertices_list())))
+
+    def _lattice_maps(self, other_cdp, stats: EqualStats = None):
+        """
+        Lazily generate lattice maps M (acting on columns) transforming self.base to other_cdp.base.
+        Only the first map M is searched for, the rest are M * g for the automorphisms g of
+        self.base.
+        """
+        M = next(self._searched_lattice_maps(other_cdp, stats), None)
+        if M is None:
+            return
+        yield M
+        if stats is not None:
+            start = perf_counter()
+        automorphisms = self.base_automorphisms()
+        if stats is not None:
+            stats.add_time('automorphisms', start)
+        for g in automorphisms[1:]:
+            if stats is not None:
+                stats.counts['automorphisms'] += 1
+            yield np.matmul(M, g)
+
+    def _searched_lattice_maps(self, other_cdp, stats: EqualStats = None):
+        """Lazily generate lattice maps M by solving for every bijection of base vertices"""
+        solve = _lattice_map_solver(self.base.vertices_list())
+        other_vertices = other_cdp.base.vertices_list()
+        perms = self._vertex_maps(other_cdp, stats)
+        if stats is None:
+            for perm in perms:
+                M = solve([other_vertices[j] for j in perm])
+                if M is not None:
+                    yield M
+            return
+        for perm in _timed(perms, stats, 'vertex_maps'):
+            stats.counts['vertex_maps'] += 1
+            start = perf_counter()
+            M = solve([other_vertices[j] for j in perm])
+            stats.add_time('solve', start)
+            if M is None:
+                stats.counts['non_unimodular'] += 1
                 continue
-            if idx + 1 == len(classes):
-                d = deepcopy(current_dict)
-                d[elem] = idx
-                return [d]
-            d = deepcopy(current_dict)
-            d[elem] = idx
-            res += self._list_mappings_recursive(classes, d, idx + 1)
-        return res
-
-    def _can_be_translated(self, mapping, other_psi_list):
-        alpha_list = []
-        for i, j in enumerate(mapping):
-            can, alpha = self.psi_list[i].can_be_translated(other_psi_list[j])
-            if not can:
-                return False
-            alpha_list.append(alpha)
-        if sum(alpha_list) != 0:
-            return False
-        return True
+            stats.counts['lattice_maps'] += 1
+            yield M
 
-    def _can_be_sheared(self, mapping, other_psi_list):
-        for i, j in enumerate(mapping):
-            if not self.psi_list[i].cat_be_sheared(other_psi_list[j]):
-                return False
-        return True
+    def _match_under(self, other_cdp, M, stats: EqualStats = None):
+        """
+        Psi mapping showing that other_cdp is obtained from self by base transformation M,
+        translation and shearing, None if there is no such mapping. Neither the CDP nor
+        Polyhedra are built: only coefficient and vertex arrays of psi are transformed.
+        """
+        if stats is not None:
+            start = perf_counter()
+        phi = np.asarray(M, dtype=np.int64)
+        phi_inverse = _integer_inverse(phi)
+        psi_list = [psi.transformed(phi, phi_inverse) for psi in self.psi_list]
+        if stats is not None:
+            stats.add_time('transform', start)
+            start = perf_counter()
+        splits, classes = self._get_equivalence_classes(other_cdp.psi_list, psi_list)
+        if stats is None:
+            if not splits:
+                return None
+            return _psi_assignment(psi_list, other_cdp.psi_list)
+        stats.add_time('classes', start)
+        if not splits:
+            stats.counts['class_splits_failed'] += 1
+            return None
+        start = perf_counter()
+        mapping = _psi_assignment(psi_list, other_cdp.psi_list, stats)
+        stats.add_time('mappings', start)
+        stats.counts['mappings'] += mapping is not None
+        return mapping
 
-    def equal(self, other_cdp):
+    def equivalence_witness(self, other_cdp):
         """
-        Suppose that zero functions are already removed
+        CDP obtained from self by a base transformation and the psi mapping (mapping[i] = j means
+        that psi_i is mapped to other psi_j) such that other_cdp is obtained from this CDP by
+        translation and shearing. None if the CDPs are not equivalent.
+        """
+        for M in self._lattice_maps(other_cdp):
+            mapping = self._match_under(other_cdp, M)
+            if mapping is not None:
+                transformation = CDPTransformation(self.n, len(self.psi_list))
+                transformation.transform_base(M)
+                return self.transformed(transformation), mapping
+        return None
+
+    def equal(self, other_cdp, workers: int = 1, stats: EqualStats = None):
+        """
+        Suppose that zero functions are already removed.
+        With workers > 1 candidate base maps are checked in a process pool, which is
+        terminated as soon as an equivalence is found. Stages are counted and timed in stats
+        if it is given.
         """
         # Check that self.base is convertible to other_cdp.base with some phi
         # Check that psi lists split into matching equivalence classes
         # Check that a constant for translation exists
         # Check that a vector for shearing exists
-        if len(self.base.vertices()) != len(other_cdp.base.vertices()):
+        if self.k != other_cdp.k:
             return False
         if len(self.psi_list) != len(other_cdp.psi_list):
             return False
-        G = np.array([np.array(vert.vector()) for vert in other_cdp.base.vertices()])
-        G = G.T
-        for perm in permutations([i for i in range(self.k)]):
-            if not self._vert_permutation_is_valid(perm):
-                continue
-            V = np.array([np.array(self.base.vertices()[i].vector()) for i in perm])
-            # A transforms base of one CDP to the base of another
-            A = self._get_transform_matrix(V, G)
-            A = linear_transformation(matrix(QQ, A))
-            cdp_after_base_transform = deepcopy(self)
-            try:
-                cdp_after_base_transform.transform_base(A)
-            except ValueError:
-                continue
-            splits, classes = cdp_after_base_transform._get_equivalence_classes(other_cdp.psi_list)
-            if not splits:
-                continue
-            mappings = cdp_after_base_transform._list_mappings(classes)
-            for m in mappings:
-                can = cdp_after_base_transform._can_be_translated(m, other_cdp.psi_list)
-                if not can:
-                    continue
-                can = cdp_after_base_transform._can_be_sheared(m, other_cdp.psi_list)
-                if not can:
-                    continue
+        if stats is not None:
+            start = perf_counter()
+        same_invariants = self.invariants() == other_cdp.invariants()
+        if stats is not None:
+            stats.add_time('invariants', start)
+            stats.counts['invariants_rejected'] += not same_invariants
+        if not same_invariants:
+            return False
+        maps = self._lattice_maps(other_cdp, stats)
+        if workers > 1:
+            return _equal_parallel(self, other_cdp, maps, workers)
+        for M in maps:
+            if self._match_under(other_cdp, M, stats) is not None:
                 return True
         return False
 
+    def invariants(self):
+        """
+        Cheap characteristics of the CDP which are preserved by equivalence: number of base
+        vertices, f-vector, normalized volume and number of lattice points of the base, sorted
+        numbers of pieces of psi, sorted normalized volumes of the domains of every psi and sizes
+        of the groups of psi with the same domains. They are computed once, transformations,
+        translations and shears do not change them.
+        """
+        if self._invariants is None:
+            vertices = self.base.vertices_list()
+            facets = self._base_facets()
+            groups = defaultdict(int)
+            for psi in self.psi_list:
+                groups[psi.fingerprint()] += 1
+            self._invariants = (self.k, f_vector(vertices, facets), normalized_volume(vertices, facets),
+                                tuple(sorted(len(psi) for psi in self.psi_list)),
+                                lattice_points_count(self.base),
+                                tuple(sorted(_domain_volumes(psi) for psi in self.psi_list)),
+                                tuple(sorted(groups.values())))
+        return self._invariants
+
+    def normal_form(self):
+        """
+        Canonical representative of the equivalence class of the CDP: equivalent CDPs have
+        equal normal forms. The base is mapped to its lattice normal form (every lattice map
+        onto it is tried and the smallest result is taken), pieces of each psi are sorted by
+        their domains and the coefficients of the first piece are reduced modulo integer
+        translations and shears. The sum of these coefficients over all psi does not change
+        under translation and shearing, so it is kept as a part of the normal form.
+        """
+        nf_base = polytope(_base_normal_form(self.base))
+        nf_vertices = nf_base.vertices_list()
+        solve = _lattice_map_solver(self.base.vertices_list())
+        best = None
+        for perm in _vertex_bijections(self.k, self._base_facets(), adjacency_map(self.base),
+                                       facet_vertex_sets(nf_base), adjacency_map(nf_base)):
+            M = solve([nf_vertices[j] for j in perm])
+            if M is None:
+                continue
+            key = self._reduced_psi_list(M)
+            if best is None or key < best:
+                best = key
+        if best is None:
+            raise ValueError('Base of the CDP should be a full-dimensional lattice polytope')
+        return tuple(tuple(exact_number(x) for x in v) for v in nf_vertices), best
 
-def facet_is_at_height_one(vertices):
-    verts = vertices[:len(vertices[0])]
-    verts = np.array([np.array(v) for v in verts])
-    u = np.ravel(np.matmul(np.linalg.inv(verts), np.ones((len(verts), 1))))
-    for x in u:
-        if not x.is_integer():
+    def canonical_hash(self):
+        # JSON does not depend on the types of equal numbers, unlike repr
+        serialized = json.dumps(self.normal_form(), default=_json_number, separators=(',', ':'))
+        return sha256(serialized.encode()).hexdigest()
+
+    def is_fano(self) -> bool:
+        """
+        Check the Fano property with the algorithm from fano.tex in exact arithmetic.
+        Conditions are checked from the cheapest one and the check stops at the first failed condition.
+        """
+        # 0 lies in the interior of the base
+        base_ineq = h_representation(self.base)
+        if not np.all(base_ineq[:, 0] > 0):
             return False
-    return True
-
-
-def generate_cdp_from_polytope(poly: Polyhedron):
-    # Walk over all facets, if facet's normal projection to x_n is positive -
-    # this facet if a part of psi_1 graph, otherwise - part of -psi_2 grapg
-
-    def plane_from_points(points):
-        # (p_11, ..., p_1n), ..., (p_n1, ..., p_nn)
-        # p_11, p_21, ..., p_n1
-        #         ...             = P
-        # p_1n, p_2n, ..., p_nn
-        # AP = b, b = (1, ..., 1) => A = bP^-1
-        # 1 - a_1*x_1 - ... - a_n*x_n = 0, return [1, -a1, ..., -a_n]
-        points = points[:len(points[0])]
-        b = Matrix([[1 for i in range(len(points[0]))]])
-        P = Matrix(points).T
-        A = b * P.inv()
-        return [Rational(1)] + [-a for a in list(A.row(0))]
-
-    def integer_coefs_from_rational(coefs):
-        qs = [c.q for c in coefs]
-        l = lcm(qs)
-        coefs = [c * l for c in coefs]
-        return [c / coefs[-1] for c in coefs]
-
-    def piecewise_from_facets(facets, invert_coefs=False):
-        pieces = []
-        for facet in facets:
-            # Find a plane equation with rational coefficients from facet's vertices
-            # and multiply by least common multiple of denominators to obtain integer
-            # coefficients.
-            r = integer_coefs_from_rational(plane_from_points([p.vector() for p in facet]))
-            if invert_coefs:
-                r = [-c for c in r]
-            pieces.append(AffineFunction(coefficients=r[:-1], domain=Polyhedron(
-                vertices=[p.vector()[:-1] for p in facet])))
-        return PiecewiseAffineFunction(affine_pieces=pieces)
-
-    psi1_facets = []
-    psi2_facets = []
-    for facet in poly.facets():
-        # Find out whether a facet belongs to psi1 or psi2
-        coef = facet.normal_cone(direction='outer').rays_list()[0][-1]
-        if coef > 0:
-            psi1_facets.append(facet.vertices())
-        elif coef < 0:
-            psi2_facets.append(facet.vertices())
-    psi1 = piecewise_from_facets(psi1_facets, invert_coefs=True)
-    psi2 = piecewise_from_facets(psi2_facets)
-    return CDP(psi_list=[psi1, psi2], base=Polyhedron(vertices=[v.vector()[:-1] for v in poly.vertices()]))
+        # Graph facets of every psi_i + a_i + 1 are at height 1. Primitive normals u are oriented
+        # with u_t > 0, so psi_i(0) + a_i + 1 = 1 / u_t > 0 holds for the found a_i
+        shifts = []
+        for psi in self.psi_list:
+            a = _fano_shift(psi)
+            if a is None:
+                return False
+            shifts.append(a)
+        if sum(shifts) != -2:
+            return False
+        return self._sum_vanishes_on_high_facets(base_ineq)
+
+    def _sum_vanishes_on_high_facets(self, base_ineq: np.ndarray) -> bool:
+        # Sum of psi is 0 on every facet of the base which is not at height 1. It is enough to check
+        # base vertices and domain vertices lying on these facets
+        heights, _ = lattice_heights(base_ineq.tolist())
+        high = base_ineq[[h != 1 for h in heights]]
+        if len(high) == 0:
+            return True
+        points = unique_rows([tuple(vert) for vert in self.base.vertices_list()] +
+                             [tuple(vert) for psi in self.psi_list for vert in psi.vertices.tolist()])
+        on_facet = np.any(high[:, :1] + np.matmul(high[:, 1:], points.T) == 0, axis=0)
+        points = points[on_facet]
+        sums = 0
+        for psi in self.psi_list:
+            values, _ = psi.values(points)
+            sums = sums + values
+        return bool(np.all(sums == 0))
+
+    def _reduced_psi_list(self, M: np.ndarray):
+        inverse = _integer_inverse(M)
+        psi_keys = []
+        const_sum = 0
+        linear_sum = [0] * self.n
+        for psi in self.psi_list:
+            pieces = []
+            for i in range(len(psi)):
+                domain = tuple(sorted(tuple(exact_number(x) for x in np.matmul(M, vert))
+                                      for vert in psi.piece_vertices(i).tolist()))
+                coefs = [to_fraction(c) for c in psi.coefs[i]]
+                linear = [sum(c * int(inverse[r, j]) for r, c in enumerate(coefs[1:])) for j in range(self.n)]
+                pieces.append((domain, coefs[0], linear))
+            pieces.sort(key=lambda p: p[0])
+            const = pieces[0][1]
+            linear = pieces[0][2]
+            const_sum += const
+            linear_sum = [x + y for x, y in zip(linear_sum, linear)]
+            const_shift = floor(const)
+            linear_shift = [floor(c) for c in linear]
+            psi_keys.append(tuple((domain, exact_number(c - const_shift),
+                                   tuple(exact_number(x - y) for x, y in zip(l, linear_shift)))
+                                  for domain, c, l in pieces))
+        return tuple(sorted(psi_keys)), exact_number(const_sum), tuple(exact_number(x) for x in linear_sum)
+
+
+# CDP pair compared by the worker process of _equal_parallel
+_equal_pair = None
+
+
+def _init_equal_worker(cdp: CDP, other_cdp: CDP):
+    global _equal_pair
+    _equal_pair = (cdp, other_cdp)
+
+
+def _matches_any(maps) -> bool:
+    cdp, other_cdp = _equal_pair
+    return any(cdp._match_under(other_cdp, np.array(M)) is not None for M in maps)
+
+
+def _equal_parallel(cdp: CDP, other_cdp: CDP, maps, workers: int, batch_size: int = 8) -> bool:
+    # The pair is sent to every worker once, tasks are batches of candidate maps. At most
+    # 2 * workers batches are queued, leaving the pool terminates it and cancels the rest
+    maps = (M.tolist() for M in maps)
+    batches = iter(lambda: list(islice(maps, batch_size)), [])
+    results = Queue()
+    pending = 0
+    with Pool(workers, initializer=_init_equal_worker, initargs=(cdp, other_cdp)) as pool:
+        for batch in islice(batches, 2 * workers):
+            pool.apply_async(_matches_any, (batch,), callback=results.put, error_callback=results.put)
+            pending += 1
+        while pending:
+            found = results.get()
+            pending -= 1
+            if isinstance(found, BaseException):
+                raise found
+            if found:
+                return True
+            batch = next(batches, None)
+            if batch is not None:
+                pool.apply_async(_matches_any, (batch,), callback=results.put, error_callback=results.put)
+                pending += 1
+    return False
+
+
+def _phi_matrices(phi):
+    """Matrices of phi and phi^-1 acting on columns, phi as in CDP.transform_base"""
+    if hasattr(phi, 'domain'):
+        try:
+            phi_inverse = phi.inverse()
+        except ZeroDivisionError:
+            raise ValueError(f'phi is not invertible')
+        # j-th columns are the image and the preimage of j-th basis vector, so that
+        # coefs * inv are the coefficients of psi o phi^-1 whatever side phi acts on
+        M = exact_array([[exact_number(x) for x in phi(e)] for e in phi.domain().basis()]).T
+        inv = exact_array([[exact_number(x) for x in phi_inverse(e)] for e in phi.codomain().basis()]).T
+        return M, inv
+    M = exact_array([[exact_number(x) for x in row] for row in phi])
+    try:
+        inv = exact_array([[exact_number(x) for x in row] for row in inverse(M.tolist())])
+    except ZeroDivisionError:
+        raise ValueError(f'phi is not invertible')
+    return M, inv
+
+
+def _check_translation(alpha_list, m: int):
+    if len(alpha_list) != m:
+        raise ValueError(f'Length of alpha_list is {len(alpha_list)}, should be {m}')
+    if sum(alpha_list) != 0:
+        raise ValueError('Sum of coefficients should be 0')
+
+
+def _check_shear(beta_list, v, m: int, n: int):
+    if len(beta_list) != m:
+        raise ValueError(f'Length of beta_list is {len(beta_list)}, should be {m}')
+    if sum(beta_list) != 0:
+        raise ValueError('Sum of coefficients should be 0')
+    if len(v) != n:
+        raise ValueError(f'Wrong dimension of v: {len(v)}, should be {n}')
+
+
+def _check_valid(psi_list: List[PiecewiseAffineFunction], base):
+    # Sum of psi should be non negative on base vertices (all psi should be defined there) and
+    # on vertices of domains laying inside of the base where all psi are defined
+    base_vertices = exact_array(base.vertices_list())
+    base_vertex_set = set(map(tuple, base_vertices.tolist()))
+    points = unique_rows(tuple(vert) for psi in psi_list for vert in psi.vertices.tolist()
+                         if tuple(vert) not in base_vertex_set)
+    if len(points):
+        base_ineq = h_representation(base)
+        inside = np.all(base_ineq[:, :1] + np.matmul(base_ineq[:, 1:], points.T) >= 0, axis=0)
+        points = points[inside]
+    k = len(base_vertices)
+    if len(points):
+        points = np.concatenate([base_vertices, points])
+    else:
+        points = base_vertices
+    sums = 0
+    defined = np.ones(len(points), dtype=bool)
+    for psi in psi_list:
+        values, psi_defined = psi.values(points)
+        sums = sums + values
+        defined &= psi_defined
+    if not np.all(defined[:k]):
+        raise ValueError('Not a valid CDP: psi is not defined on base')
+    negative = np.flatnonzero(defined & (sums < 0))
+    if len(negative):
+        idx = negative[0]
+        raise ValueError(f'Not a valid CDP - sum of psi is {sums[idx]} on {points[idx].tolist()}')
+
+
+def _domain_volumes(psi: PiecewiseAffineFunction) -> tuple:
+    # Facets of a domain are the sets of its vertices where its inequalities are tight
+    volumes = []
+    for i in range(len(psi)):
+        vertices = psi.piece_vertices(i)
+        inequalities = psi.piece_inequalities(i)
+        tight = inequalities[:, :1] + np.matmul(inequalities[:, 1:], vertices.T) == 0
+        facets = [frozenset(np.flatnonzero(row).tolist()) for row in tight]
+        volumes.append(normalized_volume(vertices.tolist(), facets))
+    return tuple(sorted(volumes))
+
+
+def _graph_heights(psi: PiecewiseAffineFunction):
+    """
+    Heights h and last coordinates u_t of the primitive normals u (u_t > 0) of the facets of the
+    graph of psi. Facet of the piece x_t = c_0 + <c, x> lies in the hyperplane <(-c, 1), v> = c_0,
+    it is the boundary of c_0 + <c, x> - x_t >= 0.
+    """
+    heights, normals = lattice_heights([list(row) + [-1] for row in psi.coefs])
+    return heights, normals[:, -1].tolist()
+
+
+def _fano_shift(psi: PiecewiseAffineFunction):
+    """Integer a such that all graph facets of psi + a + 1 are at height 1, None if there is no such a"""
+    a = None
+    for h, u_t in zip(*_graph_heights(psi)):
+        # h + (a + 1) * u_t = 1
+        a_facet = Fraction(1 - h) / u_t - 1
+        if a_facet.denominator != 1 or a is not None and a_facet != a:
+            return None
+        a = a_facet
+    return None if a is None else int(a)
+
+
+def _json_number(x):
+    if isinstance(x, Integral):
+        return int(x)
+    if isinstance(x, Fraction):
+        return str(x)
+    raise TypeError('Normal form should consist of integers and fractions, got %r' % (x,))
+
+
+def _base_normal_form(poly) -> List[List[int]]:
+    # Lattice normal form is only implemented in Sage
+    if not sage_available():
+        raise RuntimeError('Normal form of a CDP needs Sage for the lattice normal form of the base')
+    from sage.all import LatticePolytope, ZZ
+    vertices = [[ZZ(x) for x in vert] for vert in poly.vertices_list()]
+    return [[int(x) for x in v] for v in LatticePolytope(vertices).normal_form()]
+
+
+def _integer_inverse(M: np.ndarray) -> np.ndarray:
+    return np.array([[int(x) for x in row] for row in inverse(M.tolist())], dtype=np.int64)
+
+
+def _lattice_map_solver(points):
+    """
+    Prepare exact search of an integer unimodular matrix M such that M * p = q for all points p
+    and their images q. The system is solved once over QQ on n linearly independent points,
+    the rest of the points are only checked. Returns a function which takes the list of images
+    and returns M (int64 array) or None if there is no such matrix.
+    """
+    P = [[to_fraction(x) for x in p] for p in points]
+    n = len(P[0])
+    pivots = independent_rows(P)
+    if len(pivots) != n:
+        raise ValueError(f'Base of the CDP should be non-degenerate '
+                         f'(dimension {n} is provided, but '
+                         'the real dimension is lower)')
+    basis_inverse = inverse([P[i] for i in pivots])
+
+    def solve(images):
+        Q = [[to_fraction(x) for x in q] for q in images]
+        # Transposed M
+        X = [[sum(basis_inverse[r][i] * Q[pivots[i]][c] for i in range(n)) for c in range(n)]
+             for r in range(n)]
+        if any(x.denominator != 1 for row in X for x in row) or abs(determinant(X)) != 1:
+            return None
+        if any([sum(p[i] * X[i][c] for i in range(n)) for c in range(n)] != q for p, q in zip(P, Q)):
+            return None
+        return np.array([[int(X[r][c]) for r in range(n)] for c in range(n)], dtype=np.int64)
+
+    return solve
+
+
+# Number of bases whose automorphism groups are kept by _automorphisms
+AUTOMORPHISMS_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=AUTOMORPHISMS_CACHE_SIZE)
+def _automorphisms(vertices: tuple) -> tuple:
+    # Read-only arrays, they are shared by all CDPs with this base
+    base = polytope([list(v) for v in vertices])
+    vertices = base.vertices_list()
+    facets, adjacency = facet_vertex_sets(base), adjacency_map(base)
+    solve = _lattice_map_solver(vertices)
+    identity = np.identity(len(vertices[0]), dtype=np.int64)
+    group = [identity]
+    for perm in _vertex_bijections(len(vertices), facets, adjacency, facets, adjacency):
+        M = solve([vertices[j] for j in perm])
+        if M is not None and not np.array_equal(M, identity):
+            group.append(M)
+    for M in group:
+        M.flags.writeable = False
+    return tuple(group)
+
+
+def _timed(items, stats: EqualStats, stage: str):
+    # Time spent in producing every item of a lazy generator is added to the stage
+    items = iter(items)
+    while True:
+        start = perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            stats.add_time(stage, start)
+            return
+        stats.add_time(stage, start)
+        yield item
+
+
+def _shifts_vanish(affine, other_affine, stats: EqualStats = None) -> bool:
+    # Every psi mapping adds up the same translation constants and shear vectors: psi_i and
+    # the other psi it is mapped to have the same domains, so the sum over the mapping is the
+    # difference of the sums of affine_class offsets of the lists
+    total = sum(offset for _, offset in other_affine) - sum(offset for _, offset in affine)
+    vanish = all(c == 0 for c in total)
+    if stats is not None:
+        stats.counts['shifts_nonzero'] += not vanish
+    return vanish
+
+
+def _psi_assignment(psi_list, other_psi_list, stats: EqualStats = None):
+    """
+    Psi mapping (mapping[i] = j means that psi_i is mapped to other psi_j) such that other psi_j
+    is psi_i translated by an integer alpha_i and sheared by an integer vector w_i, with zero
+    sums of alphas and of ws, None if there is no such mapping.
+    Pairs which can be translated and sheared into each other have equal affine_class keys, so
+    psi are matched by their keys without enumerating mappings.
+    """
+    affine = [psi.affine_class() for psi in psi_list]
+    other_affine = [psi.affine_class() for psi in other_psi_list]
+    if not _shifts_vanish(affine, other_affine, stats):
+        return None
+    by_key = defaultdict(list)
+    for j in range(len(other_affine) - 1, -1, -1):
+        by_key[other_affine[j][0]].append(j)
+    mapping = []
+    for key, _ in affine:
+        partners = by_key.get(key)
+        if not partners:
+            if stats is not None:
+                stats.counts['pairs_rejected'] += 1
+            return None
+        mapping.append(partners.pop())
+    return mapping
+
+
+def _vertex_bijections(k, facets, adjacency, other_facets, other_adjacency, stats: EqualStats = None):
+    """Backtracking search of vertex bijections mapping facets onto facets.
+    Vertices are assigned one at a time, every facet keeps the set of facets of the other
+    polytope it still can be mapped to, and a branch is cut as soon as one of these sets is empty.
+    """
+    if len(facets) != len(other_facets):
+        return
+    vertex_facets = [set() for _ in range(k)]
+    other_vertex_facets = [set() for _ in range(k)]
+    for f, facet in enumerate(facets):
+        for i in facet:
+            vertex_facets[i].add(f)
+    for f, facet in enumerate(other_facets):
+        for j in facet:
+            other_vertex_facets[j].add(f)
+
+    def signature(i, vf, fs, adj):
+        return len(adj[i]), tuple(sorted(len(fs[f]) for f in vf[i]))
+
+    other_signatures = [signature(j, other_vertex_facets, other_facets, other_adjacency)
+                        for j in range(k)]
+    candidates = []
+    for i in range(k):
+        sig = signature(i, vertex_facets, facets, adjacency)
+        candidates.append([j for j in range(k) if other_signatures[j] == sig])
+        if not candidates[-1]:
+            return
+    order = sorted(range(k), key=lambda i: (len(candidates[i]), i))
+    facet_images = [{g for g, other in enumerate(other_facets) if len(other) == len(facet)}
+                    for facet in facets]
+    perm = [None] * k
+    used = [False] * k
+
+    def extend(depth):
+        if depth == k:
+            yield tuple(perm)
+            return
+        i = order[depth]
+        for j in candidates[i]:
+            if used[j]:
+                continue
+            saved = list(facet_images)
+            consistent = True
+            for f, facet in enumerate(facets):
+                if i in facet:
+                    refined = facet_images[f] & other_vertex_facets[j]
+                else:
+                    refined = facet_images[f] - other_vertex_facets[j]
+                if not refined:
+                    consistent = False
+                    break
+                facet_images[f] = refined
+            if consistent:
+                perm[i] = j
+                used[j] = True
+                yield from extend(depth + 1)
+                used[j] = False
+            elif stats is not None:
+                stats.counts['incidence_pruned'] += 1
+            facet_images[:] = saved
+
+    yield from extend(0)
+
+
+def facet_is_at_height_one(vertices) -> bool:
+    """
+    Check that there is an integer u with <u, v> = 1 for the vertices of a facet. The hyperplane
+    through the vertices is found exactly, facets through the origin are not at height 1.
+    To check all facets of a polytope at once use polytope.facet_heights.
+    """
+    # (u, c) with <u, v> - c = 0 for all vertices, facet hyperplane is unique up to a factor
+    solutions = nullspace([[to_fraction(x) for x in vert] + [-1] for vert in vertices], len(vertices[0]) + 1)
+    if len(solutions) != 1 or solutions[0][-1] == 0:
+        return False
+    u = [x / solutions[0][-1] for x in solutions[0][:-1]]
+    return all(x.denominator == 1 for x in u)
+
 
+def generate_cdp_from_polytope(poly):
+    """
+    CDP of a polytope in R^(n + 1): the base is its projection along the last coordinate, psi_1 is
+    the upper boundary and psi_2 is the negated lower boundary of the polytope, so the sum of psi is
+    its height over the base. Facets are read from the H-representation in one pass: a facet
+    b + <a, x> + a_t * t >= 0 with a_t < 0 is a piece of psi_1, with a_t > 0 - of psi_2, vertical
+    facets with a_t = 0 are skipped. Pieces are the facet planes over projected facet vertices.
+    """
+    vertices = exact_array(poly.vertices_list())
+    inequalities = h_representation(poly)
+    on_facet = inequalities[:, :1] + np.matmul(inequalities[:, 1:], vertices.T) == 0
+    upper, lower = [], []
+    for row, incident in zip(inequalities.tolist(), on_facet):
+        a_t = row[-1]
+        if a_t == 0:
+            continue
+        # t = -(b + <a, x>) / a_t on the facet
+        coefs = [exact_number(to_fraction(c) / -to_fraction(a_t)) for c in row[:-1]]
+        domain = polytope(vertices[incident][:, :-1].tolist())
+        if a_t < 0:
+            upper.append(AffineFunction(coefficients=coefs, domain=domain))
+        else:
+            lower.append(AffineFunction(coefficients=[-c for c in coefs], domain=domain))
+    psi1 = PiecewiseAffineFunction(affine_pieces=upper)
+    psi2 = PiecewiseAffineFunction(affine_pieces=lower)
+    # Sum of psi is the height of poly over the base, so the CDP is valid
+    return CDP(psi_list=[psi1, psi2], base=polytope(vertices[:, :-1].tolist()), validate=False)
@@ -0,0 +1,56 @@
+#!/usr/bin/env sage
+from typing import List
+from collections import defaultdict, namedtuple
+from time import perf_counter
+from cdp import CDP
+
+
+BucketReport = namedtuple('BucketReport', ['invariants', 'size', 'classes', 'comparisons', 'seconds'])
+
+
+class DisjointSets:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+def classify(cdps: List[CDP]):
+    """
+    Split cdps into equivalence classes. CDPs are bucketed by invariants first, and
+    CDP.equal is only called inside a bucket, against one representative of each class
+    found so far.
+    Returns classes as lists of indices of cdps and a BucketReport for every bucket.
+    """
+    buckets = defaultdict(list)
+    for i, cdp in enumerate(cdps):
+        buckets[cdp.invariants()].append(i)
+    sets = DisjointSets(len(cdps))
+    reports = []
+    for invariants, bucket in buckets.items():
+        start = perf_counter()
+        comparisons = 0
+        representatives = []
+        for i in bucket:
+            for r in representatives:
+                comparisons += 1
+                if cdps[r].equal(cdps[i]):
+                    sets.union(r, i)
+                    break
+            else:
+                representatives.append(i)
+        reports.append(BucketReport(invariants, len(bucket), len(representatives), comparisons,
+                                    perf_counter() - start))
+    classes = defaultdict(list)
+    for i in range(len(cdps)):
+        classes[sets.find(i)].append(i)
+    return list(classes.values()), reports
@@ -1,27 +1,99 @@
-#!/usr/bin/env sage
+#!/usr/bin/env python
 from typing import List
-from sage.all import *
+from copy import copy
 import numpy as np
+from polytope import polytope, exact_number
+
+
+def exact_array(rows) -> np.ndarray:
+    """
+    Numpy array of exact numbers: int64 if all entries are integers, object dtype with
+    ints and Fractions otherwise
+    """
+    if isinstance(rows, np.ndarray) and rows.dtype.kind in 'iu':
+        return rows.astype(np.int64, copy=False)
+    arr = np.array(rows, dtype=object)
+    if all(_is_integer(x) for x in arr.flat):
+        return arr.astype(np.int64)
+    return _exact_numbers(arr)
+
+
+# Coefficients and coordinates may come from Sage, SymPy or fractions, they are kept as ints
+# and Fractions so that numbers of different origin compare and hash equally
+_exact_numbers = np.frompyfunc(exact_number, 1, 1)
+
+
+def _is_integer(x) -> bool:
+    try:
+        return x == int(x)
+    except (TypeError, ValueError):
+        return False
+
+
+def _sorted_rows(rows) -> np.ndarray:
+    return exact_array(sorted(tuple(row) for row in rows))
+
+
+def unique_rows(rows) -> np.ndarray:
+    return _sorted_rows(set(map(tuple, rows)))
+
+
+def h_representation(domain) -> np.ndarray:
+    # Rows [b, a_1, ..., a_n] of inequalities b + <a, x> >= 0, equations are split into two inequalities
+    rows = [list(ineq) for ineq in domain.inequalities_list()]
+    for eq in domain.equations_list():
+        rows.append(list(eq))
+        rows.append([-c for c in eq])
+    return exact_array(rows)
+
+
+# Pieces are located through PieceIndex only for functions with many pieces,
+# for small ones checking all inequalities at once is faster
+INDEX_MIN_PIECES = 32
 
 
 class AffineFunction:
-    def __init__(self, coefficients: List[float], domain: Polyhedron):
-        dim = len(domain.vertices()[0].vector())
+    def __init__(self, coefficients: List[float], domain):
+        # domain is a polytope of any backend, see polytope.py
+        dim = len(domain.vertices_list()[0])
         if len(coefficients) != dim + 1:
             raise ValueError(f'Domain dimension {len(coefficients) - 1} '
                              f'and coefficients list dimension {dim} do not match')
         self.coefs = list(coefficients)
-        self.domain = domain
+        self.vertices = _sorted_rows(domain.vertices_list())
+        self.inequalities = h_representation(domain)
         self.dim = dim
+        self._domain = domain
+
+    @classmethod
+    def _from_arrays(cls, coefficients, vertices: np.ndarray, inequalities: np.ndarray):
+        piece = cls.__new__(cls)
+        piece.coefs = list(coefficients)
+        piece.vertices = vertices
+        piece.inequalities = inequalities
+        piece.dim = vertices.shape[1]
+        piece._domain = None
+        return piece
+
+    @property
+    def domain(self):
+        # Polytope is only built when it is needed
+        if self._domain is None:
+            self._domain = polytope(self.vertices.tolist())
+        return self._domain
 
     def __eq__(self, other):
-        return self.coefs == other.coefs and self.domain == other.domain
+        return self.coefs == other.coefs and np.array_equal(self.vertices, other.vertices)
+
+    def contains(self, x) -> bool:
+        x = exact_array(list(x))
+        return bool(np.all(self.inequalities[:, 0] + self.inequalities[:, 1:] @ x >= 0))
 
     def value(self, x: List[int]):
-        if x not in self.domain:
-            raise ValueError(f'{x} is not in function domain {self.domain.vertices()}')
         if len(x) != self.dim:
             raise ValueError(f'Wrong dimension of x: {len(x)}')
+        if not self.contains(x):
+            raise ValueError(f'{x} is not in function domain {self.vertices.tolist()}')
         return sum([a * b for a, b in zip(self.coefs[1:], x)]) + self.coefs[0]
 
     def _coef_str(self, i):
@@ -42,70 +114,256 @@ class AffineFunction:
         for i in range(1, len(self.coefs)):
             coefs_repr.append(self._coef_str(i))
         coefs_repr = "".join(coefs_repr)
-        return f'Affine function {coefs_repr} with domain ' \
-               f'{[vert.vector() for vert in self.domain.vertices()]}'
+        domain = ', '.join('(' + ', '.join(map(str, vert)) + ')' for vert in self.vertices.tolist())
+        return f'Affine function {coefs_repr} with domain [{domain}]'
+
+
+class PieceIndex:
+    """
+    Bounding box tree over the pieces of a piecewise affine function. Boxes are split in halves
+    by the centers along the widest axis, so a point is checked against O(log(pieces)) boxes
+    when the pieces do not overlap much.
+    """
+    def __init__(self, lower: np.ndarray, upper: np.ndarray, leaf_size: int = 4):
+        # lower, upper - (pieces x n) corners of the bounding boxes of pieces
+        self.lower = lower
+        self.upper = upper
+        self.leaf_size = leaf_size
+        self.nodes = []
+        self._build(np.arange(len(lower)))
+
+    def _build(self, pieces: np.ndarray) -> int:
+        lower = self.lower[pieces].min(axis=0)
+        upper = self.upper[pieces].max(axis=0)
+        node = len(self.nodes)
+        self.nodes.append(None)
+        if len(pieces) <= self.leaf_size:
+            self.nodes[node] = (lower, upper, None, None, pieces)
+            return node
+        axis = np.argmax(upper - lower)
+        centers = self.lower[pieces, axis] + self.upper[pieces, axis]
+        pieces = pieces[np.argsort(centers, kind='stable')]
+        half = len(pieces) // 2
+        left = self._build(pieces[:half])
+        right = self._build(pieces[half:])
+        self.nodes[node] = (lower, upper, left, right, None)
+        return node
+
+    def candidates(self, x: np.ndarray) -> List[int]:
+        """Sorted indices of the pieces whose bounding boxes contain x"""
+        result = []
+        stack = [0]
+        while stack:
+            lower, upper, left, right, pieces = self.nodes[stack.pop()]
+            if np.any(x < lower) or np.any(x > upper):
+                continue
+            if pieces is None:
+                stack.append(left)
+                stack.append(right)
+            else:
+                inside = np.all((self.lower[pieces] <= x) & (x <= self.upper[pieces]), axis=1)
+                result.extend(pieces[inside].tolist())
+        return sorted(result)
 
 
 class PiecewiseAffineFunction:
+    """
+    Pieces are stored packed: coefs is a (pieces x (n + 1)) matrix, domain vertices and
+    inequalities b + <a, x> >= 0 (rows [b, a_1, ..., a_n]) of all pieces are stacked into
+    single arrays, rows of i-th piece are offsets[i]:offsets[i + 1].
+    Functions are not changed after construction: translated, sheared and transformed return
+    new functions sharing all arrays except the changed ones, so one function may be used by
+    several CDPs. affine_pieces are read-only views.
+    """
     def __init__(self, affine_pieces: List[AffineFunction]):
-        self.affine_pieces = affine_pieces
+        self._set_arrays(np.array([piece.coefs for piece in affine_pieces], dtype=object),
+                         np.concatenate([piece.vertices for piece in affine_pieces]),
+                         np.cumsum([0] + [len(piece.vertices) for piece in affine_pieces]),
+                         np.concatenate([piece.inequalities for piece in affine_pieces]),
+                         np.cumsum([0] + [len(piece.inequalities) for piece in affine_pieces]))
+
+    @classmethod
+    def from_arrays(cls, coefs: np.ndarray, vertices: np.ndarray, vertex_offsets: np.ndarray,
+                    inequalities: np.ndarray, inequality_offsets: np.ndarray):
+        """Build the function from packed arrays without constructing polyhedra of the domains"""
+        psi = cls.__new__(cls)
+        psi._set_arrays(coefs, vertices, vertex_offsets, inequalities, inequality_offsets)
+        return psi
+
+    def _set_arrays(self, coefs, vertices, vertex_offsets, inequalities, inequality_offsets):
+        self.n = coefs.shape[1] - 1
+        self.coefs = _exact_numbers(coefs).astype(object)
+        self.vertices = vertices
+        self.vertex_offsets = vertex_offsets
+        self.inequalities = inequalities
+        self.inequality_offsets = inequality_offsets
+        self._pieces = None
+        self._index = None
+        self._fingerprints = None
+
+    def __len__(self):
+        return len(self.coefs)
+
+    def piece_vertices(self, i: int) -> np.ndarray:
+        return self.vertices[self.vertex_offsets[i]:self.vertex_offsets[i + 1]]
+
+    def piece_inequalities(self, i: int) -> np.ndarray:
+        return self.inequalities[self.inequality_offsets[i]:self.inequality_offsets[i + 1]]
+
+    @property
+    def affine_pieces(self) -> List[AffineFunction]:
+        if self._pieces is None:
+            self._pieces = [AffineFunction._from_arrays(self.coefs[i], self.piece_vertices(i),
+                                                        self.piece_inequalities(i))
+                            for i in range(len(self))]
+        return self._pieces
 
     def __eq__(self, other):
-        if not len(self.affine_pieces) == len(other.affine_pieces):
+        if not len(self) == len(other):
             return False
-        for piece in self.affine_pieces:
-            if not piece in other.affine_pieces:
-                return False
-        return True
+        mapping = self._domains_mapping(other)
+        if mapping is None:
+            return False
+        return all(list(self.coefs[i]) == list(other.coefs[j]) for i, j in enumerate(mapping))
+
+    def index(self) -> PieceIndex:
+        if self._index is None:
+            lower = np.array([self.piece_vertices(i).min(axis=0) for i in range(len(self))])
+            upper = np.array([self.piece_vertices(i).max(axis=0) for i in range(len(self))])
+            self._index = PieceIndex(lower, upper)
+        return self._index
+
+    def locate(self, points) -> np.ndarray:
+        """Index of the first piece containing each of (m x n) points, -1 for points outside the domain"""
+        points = exact_array(points)
+        if len(self) < INDEX_MIN_PIECES:
+            return self._locate_all(points)
+        return self._locate_indexed(points)
+
+    def _locate_indexed(self, points: np.ndarray) -> np.ndarray:
+        index = self.index()
+        result = np.full(len(points), -1)
+        for k, x in enumerate(points):
+            for i in index.candidates(x):
+                ineq = self.piece_inequalities(i)
+                if np.all(ineq[:, 0] + np.matmul(ineq[:, 1:], x) >= 0):
+                    result[k] = i
+                    break
+        return result
+
+    def _locate_all(self, points: np.ndarray) -> np.ndarray:
+        # (inequalities x m) matrix of inequality checks, reduced to (pieces x m) membership matrix
+        satisfied = self.inequalities[:, :1] + np.matmul(self.inequalities[:, 1:], points.T) >= 0
+        inside = np.logical_and.reduceat(satisfied, self.inequality_offsets[:-1], axis=0)
+        return np.where(inside.any(axis=0), np.argmax(inside, axis=0), -1)
+
+    def values(self, points):
+        """
+        Values of the function on (m x n) points and the mask of points where it is defined,
+        values on points outside the domain are 0
+        """
+        points = exact_array(points)
+        pieces = self.locate(points)
+        defined = pieces >= 0
+        coefs = self.coefs[pieces]
+        values = coefs[:, 0] + np.sum(coefs[:, 1:] * points, axis=1)
+        values[~defined] = 0
+        return values, defined
 
     def value(self, x: List[int]):
-        for piece in self.affine_pieces:
-            if x in piece.domain:
-                return piece.value(x)
-        raise ValueError(f'{x} is not in function domain')
-
-    def transform(self, phi, phi_inverse):
-        for j in range(len(self.affine_pieces)):
-            res = np.matmul(self.affine_pieces[j].coefs[1:], phi_inverse)
-            self.affine_pieces[j].coefs = [self.affine_pieces[j].coefs[0]]
-            self.affine_pieces[j].coefs.extend(res)
-            vertices = []
-            for vert in self.affine_pieces[j].domain.vertices():
-                vertices.append(phi(vert.vector()))
-            self.affine_pieces[j].domain = Polyhedron(vertices=vertices)
+        if len(x) != self.n:
+            raise ValueError(f'Wrong dimension of x: {len(x)}')
+        values, defined = self.values([list(x)])
+        if not defined[0]:
+            raise ValueError(f'{x} is not in function domain')
+        return values[0]
+
+    def translated(self, alpha):
+        """psi + alpha as a new function sharing the domains with this one"""
+        return self._with_coefs(self._shifted_coefs(alpha, [0] * self.n))
+
+    def sheared(self, v):
+        """u -> psi(u) + <u, v> as a new function sharing the domains with this one"""
+        return self._with_coefs(self._shifted_coefs(0, v))
+
+    def _shifted_coefs(self, alpha, v) -> np.ndarray:
+        return self.coefs + np.array([exact_number(alpha)] + [exact_number(x) for x in v], dtype=object)
+
+    def _with_coefs(self, coefs: np.ndarray):
+        # Domain arrays, fingerprints and the index are shared, pieces are built again on demand
+        psi = copy(self)
+        psi.coefs = coefs
+        psi._pieces = None
+        return psi
+
+    def transformed(self, phi: np.ndarray, phi_inverse: np.ndarray):
+        """
+        psi o phi^-1 as a new function sharing offsets with this one, phi and phi_inverse are
+        matrices acting on columns
+        """
+        psi = self._with_coefs(np.concatenate([self.coefs[:, :1], np.matmul(self.coefs[:, 1:], phi_inverse)],
+                                              axis=1))
+        psi.inequalities = exact_array(np.concatenate(
+            [self.inequalities[:, :1], np.matmul(self.inequalities[:, 1:], phi_inverse)], axis=1))
+        vertices = np.matmul(self.vertices, phi.T)
+        psi.vertices = exact_array(np.concatenate(
+            [_sorted_rows(vertices[self.vertex_offsets[i]:self.vertex_offsets[i + 1]])
+             for i in range(len(self))]))
+        psi._index = None
+        psi._fingerprints = None
+        return psi
+
+    def domain_fingerprints(self) -> tuple:
+        """Hashable fingerprints of the domains: tuples of sorted vertices"""
+        if self._fingerprints is None:
+            self._fingerprints = tuple(tuple(map(tuple, self.piece_vertices(i).tolist()))
+                                       for i in range(len(self)))
+        return self._fingerprints
+
+    def fingerprint(self) -> tuple:
+        """Hashable fingerprint of the set of domains, equal for functions with the same domains"""
+        return tuple(sorted(self.domain_fingerprints()))
 
     def _domains_mapping(self, other_psi):
-        if len(self.affine_pieces) != len(other_psi.affine_pieces):
-            return False, 0
-        domains_mapping = [0 for _ in range(len(other_psi.affine_pieces))]
-        for i, piece in enumerate(self.affine_pieces):
-            for j, other_piece in enumerate(other_psi.affine_pieces):
-                if piece.domain == other_piece.domain:
-                    domains_mapping[i] = j
+        if len(self) != len(other_psi):
+            return None
+        other_pieces = {fp: j for j, fp in enumerate(other_psi.domain_fingerprints())}
+        domains_mapping = [other_pieces.get(fp) for fp in self.domain_fingerprints()]
+        if None in domains_mapping:
+            return None
         return domains_mapping
 
+    def affine_class(self):
+        """
+        (key, offset): keys of two functions are equal iff they have the same domains and differ
+        by an affine function with integer coefficients. offset are the coefficients of the piece
+        with the least domain, the difference of the functions is other offset - offset.
+        """
+        fingerprints = self.domain_fingerprints()
+        order = sorted(range(len(self)), key=fingerprints.__getitem__)
+        coefs = self.coefs[order]
+        offset = coefs[0]
+        key = (tuple(fingerprints[i] for i in order),
+               tuple(map(tuple, (coefs - offset).tolist())),
+               tuple(c % 1 for c in offset.tolist()))
+        return key, offset
+
     def can_be_translated(self, other_psi):
         domains_mapping = self._domains_mapping(other_psi)
-        alpha = other_psi.affine_pieces[domains_mapping[0]].coefs[0] - self.affine_pieces[0].coefs[0]
-        for i in range(1, len(domains_mapping)):
-            a = other_psi.affine_pieces[domains_mapping[i]].coefs[0] - self.affine_pieces[i].coefs[0]
-            if a != alpha:
-                return False, 0
-        return True, alpha
+        if domains_mapping is None:
+            return False, 0
+        alphas = other_psi.coefs[domains_mapping, 0] - self.coefs[:, 0]
+        if any(a != alphas[0] for a in alphas[1:]):
+            return False, 0
+        return True, alphas[0]
 
     def cat_be_sheared(self, other_psi):
         domains_mapping = self._domains_mapping(other_psi)
-        n = len(other_psi.affine_pieces[domains_mapping[0]].coefs)
-        v = [other_psi.affine_pieces[domains_mapping[0]].coefs[i] - self.affine_pieces[0].coefs[i]
-             for i in range(1, n)]
-        for j in range(1, len(domains_mapping)):
-            other_v = [other_psi.affine_pieces[domains_mapping[j]].coefs[i] - self.affine_pieces[j].coefs[i]
-                for i in range(1, n)]
-            if other_v != v:
-                return False
-        return True
+        if domains_mapping is None:
+            return False
+        vs = other_psi.coefs[domains_mapping, 1:] - self.coefs[:, 1:]
+        return all(list(v) == list(vs[0]) for v in vs[1:])
 
     def __str__(self):
         resp = '\n'.join([str(piece) for piece in self.affine_pieces])
         return 'Piecewise affine function:\n' + resp
-
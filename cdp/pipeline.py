@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+from collections import deque
+from itertools import combinations, islice, product
+from math import comb
+from multiprocessing import Pool
+from typing import Iterable, Iterator, List
+from cdp import generate_cdp_from_polytope
+from polytope import polytope, sage_available
+
+
+def lattice_polytopes_in_box(dim: int, bound: int, max_vertices: int, processes: int = 1,
+                             chunk_size: int = 4096) -> Iterator[List[List[int]]]:
+    """
+    Full-dimensional lattice polytopes with vertices in [-bound, bound]^dim and at most max_vertices
+    vertices. Every polytope is generated once - from the set of its own vertices, so nothing has
+    to be remembered between polytopes. Equivalent polytopes are not filtered out here: equivalence
+    of polytopes does not imply equivalence of their CDPs, CDPs are deduplicated by canonical hash.
+    Subsets of points are checked in chunks of chunk_size, with processes != 1 the chunks go to a
+    process pool (None - one process per CPU), at most 2 * processes chunks at a time. Polytopes
+    come in the same order in both cases.
+    """
+    chunks = _subset_chunks(dim, bound, max_vertices, chunk_size)
+    if processes == 1:
+        for chunk in chunks:
+            yield from _polytopes_in_chunk(chunk)
+        return
+    with Pool(processes=processes) as pool:
+        window = 2 * (processes or os.cpu_count())
+        pending = deque(pool.apply_async(_polytopes_in_chunk, (chunk,)) for chunk in islice(chunks, window))
+        while pending:
+            polytopes = pending.popleft().get()
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(pool.apply_async(_polytopes_in_chunk, (chunk,)))
+            yield from polytopes
+
+
+def _subset_chunks(dim: int, bound: int, max_vertices: int, chunk_size: int) -> Iterator[tuple]:
+    # (dim, bound, size, start, stop): subsets number start:stop of the given size in the order
+    # of itertools.combinations
+    points = (2 * bound + 1) ** dim
+    for size in range(dim + 1, max_vertices + 1):
+        total = comb(points, size)
+        for start in range(0, total, chunk_size):
+            yield dim, bound, size, start, min(start + chunk_size, total)
+
+
+def _polytopes_in_chunk(chunk: tuple) -> List[List[List[int]]]:
+    dim, bound, size, start, stop = chunk
+    points = list(product(range(-bound, bound + 1), repeat=dim))
+    polytopes = []
+    for subset in islice(combinations(points, size), start, stop):
+        poly = polytope(subset)
+        if poly.dim() == dim and poly.n_vertices() == size:
+            polytopes.append([[int(x) for x in vert] for vert in poly.vertices_list()])
+    return polytopes
+
+
+def read_polytopes(path: str) -> Iterator[List[List[int]]]:
+    """Polytopes from a file with a JSON list of vertices on every line"""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def cdp_record(vertices: List[List[int]]) -> dict:
+    """Build the CDP of the polytope and check it, only this small record is sent back to the parent"""
+    try:
+        cdp = generate_cdp_from_polytope(polytope(vertices))
+        return {'vertices': vertices, 'fano': cdp.is_fano(), 'hash': cdp.canonical_hash()}
+    except (ValueError, ArithmeticError) as e:
+        return {'vertices': vertices, 'error': f'{type(e).__name__}: {e}'}
+
+
+def run(polytopes: Iterable[List[List[int]]], output_path: str, processes: int = None,
+        batch_size: int = 256) -> dict:
+    """
+    Stream polytopes through a process pool and write one JSON record per polytope to output_path
+    as soon as it is ready. At most batch_size polytopes are in flight, so memory does not depend
+    on the number of polytopes. A record is marked as new if no equivalent CDP was seen before.
+    Returns counts of processed polytopes, failures, Fano CDPs and equivalence classes.
+    Canonical hashes need Sage, without it nothing is started.
+    """
+    if not sage_available():
+        raise RuntimeError('Canonical hashes of CDPs need Sage, install it to run the pipeline')
+    seen = set()
+    counts = {'polytopes': 0, 'errors': 0, 'fano': 0, 'classes': 0}
+    polytopes = iter(polytopes)
+    with Pool(processes=processes) as pool, open(output_path, 'w') as out:
+        while True:
+            batch = list(islice(polytopes, batch_size))
+            if not batch:
+                break
+            for record in pool.imap_unordered(cdp_record, batch):
+                counts['polytopes'] += 1
+                if 'error' in record:
+                    counts['errors'] += 1
+                else:
+                    record['new'] = record['hash'] not in seen
+                    seen.add(record['hash'])
+                    counts['classes'] += record['new']
+                    counts['fano'] += record['fano']
+                out.write(json.dumps(record) + '\n')
+            out.flush()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate CDPs from lattice polytopes and check them')
+    parser.add_argument('output', help='file for JSON records')
+    parser.add_argument('--input', help='file with a JSON list of polytope vertices on every line')
+    parser.add_argument('--dim', type=int, default=3)
+    parser.add_argument('--bound', type=int, default=1)
+    parser.add_argument('--max-vertices', type=int, default=6)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+    if args.input:
+        source = read_polytopes(args.input)
+    else:
+        source = lattice_polytopes_in_box(args.dim, args.bound, args.max_vertices, processes=args.processes)
+    print(run(source, args.output, processes=args.processes))
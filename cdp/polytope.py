@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+import os
+from collections import defaultdict
+from fractions import Fraction
+from importlib.util import find_spec
+from itertools import combinations
+from math import ceil, floor, gcd
+from numbers import Integral
+from typing import List
+import numpy as np
+
+# Polytopes are built through polytope(vertices) with the backend selected by set_backend or by the
+# CDP_POLYTOPE_BACKEND environment variable. 'sage' builds Sage Polyhedra and imports Sage on the
+# first use, it is the default when Sage is installed. 'exact' is the pure Python implementation
+# below, its convex hull is only fast enough for few vertices in low dimensions. Code using polytopes
+# only relies on vertices_list, inequalities_list, equations_list, dim, contains and == of both of
+# them, facets and adjacency are taken through facet_vertex_sets and adjacency_map.
+BACKENDS = ('exact', 'sage')
+
+
+def sage_available() -> bool:
+    try:
+        return find_spec('sage.all') is not None
+    except ImportError:
+        return False
+
+
+def _default_backend() -> str:
+    return 'sage' if sage_available() else 'exact'
+
+
+def set_backend(name: str):
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown polytope backend {name}, should be one of {BACKENDS}')
+    _backend = name
+
+
+set_backend(os.environ.get('CDP_POLYTOPE_BACKEND') or _default_backend())
+
+
+def get_backend() -> str:
+    return _backend
+
+
+def to_fraction(c) -> Fraction:
+    """Exact value of an int, Fraction, Sage, SymPy or numpy number, floats are read from their repr"""
+    # numpy integers are Integral, their Fractions would keep numpy numerators
+    if isinstance(c, Integral):
+        return Fraction(int(c))
+    if isinstance(c, Fraction):
+        return Fraction(int(c.numerator), int(c.denominator))
+    if isinstance(c, float):
+        return Fraction(repr(float(c)))
+    # SymPy rationals
+    if hasattr(c, 'p') and hasattr(c, 'q'):
+        return Fraction(int(c.p), int(c.q))
+    # Sage rationals and integers
+    if callable(getattr(c, 'numerator', None)):
+        return Fraction(int(c.numerator()), int(c.denominator()))
+    return Fraction(c)
+
+
+def exact_number(c):
+    """int if c is an integer, Fraction otherwise"""
+    c = to_fraction(c)
+    return int(c.numerator) if c.denominator == 1 else c
+
+
+def polytope(vertices):
+    """Convex hull of the points with the selected backend"""
+    if _backend == 'sage':
+        from sage.all import Polyhedron
+        return Polyhedron(vertices=[list(v) for v in vertices])
+    return ExactPolytope(vertices)
+
+
+def same_polytope(poly, other) -> bool:
+    """Polytopes of any backends are equal if they have the same vertices"""
+    return sorted(tuple(exact_number(x) for x in vert) for vert in poly.vertices_list()) == \
+        sorted(tuple(exact_number(x) for x in vert) for vert in other.vertices_list())
+
+
+def facet_vertex_sets(poly) -> List[frozenset]:
+    """Facets as sets of indices of vertices in poly.vertices_list()"""
+    if isinstance(poly, ExactPolytope):
+        return poly.facet_vertex_sets()
+    return [frozenset(v.index() for v in ineq.incident()) for ineq in poly.inequalities()]
+
+
+def adjacency_map(poly) -> defaultdict:
+    """Indices of the neighbours of every vertex along the edges"""
+    adjacency_map = defaultdict(set)
+    if isinstance(poly, ExactPolytope):
+        edges = poly.edges()
+    else:
+        adjacency = poly.vertex_adjacency_matrix()
+        k = poly.n_vertices()
+        edges = [(i, j) for i in range(k) for j in range(i + 1, k) if adjacency[i, j]]
+    for i, j in edges:
+        adjacency_map[i].add(j)
+        adjacency_map[j].add(i)
+    return adjacency_map
+
+
+def affine_dim(points) -> int:
+    if len(points) == 0:
+        return -1
+    origin = [to_fraction(x) for x in points[0]]
+    return rank([[to_fraction(x) - y for x, y in zip(p, origin)] for p in points[1:]]) if len(points) > 1 else 0
+
+
+def faces(vertices, facets) -> List[frozenset]:
+    """All non-empty faces as sets of vertex indices: intersections of facets and the polytope itself"""
+    result = {frozenset(range(len(vertices)))}
+    layer = set(facets)
+    while layer:
+        result |= layer
+        layer = {f & g for f in layer for g in facets if f & g} - result
+    return list(result)
+
+
+def f_vector(vertices, facets) -> tuple:
+    """Numbers of faces of every dimension from the empty face to the polytope, as in Sage"""
+    dim = affine_dim(vertices)
+    counts = [0] * (dim + 1)
+    for face in faces(vertices, facets):
+        counts[affine_dim([vertices[i] for i in face])] += 1
+    return tuple([1] + counts)
+
+
+def normalized_volume(vertices, facets):
+    """
+    n! times the volume of a full-dimensional polytope in R^n given by its vertices and facets as
+    sets of vertex indices, 0 for lower dimensional polytopes. The polytope is split into simplices
+    by the pulling triangulation: cones from the first vertex over the triangulated facets not containing it.
+    """
+    points = [[to_fraction(x) for x in vert] for vert in vertices]
+    n = len(points[0])
+    if affine_dim(points) < n:
+        return 0
+    total = Fraction(0)
+    for simplex in _pulling(frozenset(range(len(points))), n, facets, points):
+        origin = points[simplex[0]]
+        total += abs(determinant([[x - y for x, y in zip(points[i], origin)] for i in simplex[1:]]))
+    return exact_number(total)
+
+
+def _pulling(face: frozenset, dim: int, facets, points):
+    if dim == 0:
+        yield [min(face)]
+        return
+    apex = min(face)
+    subfaces = {face & facet for facet in facets} - {face}
+    for subface in subfaces:
+        if apex not in subface and affine_dim([points[i] for i in subface]) == dim - 1:
+            for simplex in _pulling(subface, dim - 1, facets, points):
+                yield [apex] + simplex
+
+
+def lattice_points_count(poly) -> int:
+    """Number of integer points of the polytope, points of the bounding box are checked at once"""
+    vertices = [[to_fraction(x) for x in vert] for vert in poly.vertices_list()]
+    lower = [ceil(min(column)) for column in zip(*vertices)]
+    upper = [floor(max(column)) for column in zip(*vertices)]
+    if any(lo > up for lo, up in zip(lower, upper)):
+        return 0
+    grid = np.stack(np.meshgrid(*[np.arange(lo, up + 1) for lo, up in zip(lower, upper)],
+                                indexing='ij'), axis=-1).reshape(-1, len(lower))
+    grid = grid.astype(object)
+    inside = np.ones(len(grid), dtype=bool)
+    for rows, equal in [(poly.inequalities_list(), False), (poly.equations_list(), True)]:
+        for row in rows:
+            row = [to_fraction(x) for x in row]
+            scale = _denominators_lcm(row)
+            values = int(row[0] * scale) + grid @ np.array([int(x * scale) for x in row[1:]], dtype=object)
+            inside &= values == 0 if equal else values >= 0
+    return int(inside.sum())
+
+
+def lattice_heights(inequalities) -> (list, np.ndarray):
+    """
+    Lattice heights h and primitive integer normals u of the hyperplanes b + <a, x> = 0 given by rows
+    [b, a_1, ..., a_n]: u = -a scaled to coprime integers, <u, x> = h on the hyperplane. For inner
+    inequalities of a polytope u are outer normals and h > 0 iff the origin lies strictly inside.
+    """
+    heights = []
+    normals = []
+    for row in inequalities:
+        row = [to_fraction(x) for x in row]
+        a = primitive(row[1:])
+        i = next(i for i, x in enumerate(a) if x)
+        heights.append(exact_number(row[0] * a[i] / row[1 + i]))
+        normals.append([-x for x in a])
+    return heights, np.array(normals, dtype=np.int64).reshape(len(normals), -1)
+
+
+def facet_heights(poly) -> (list, np.ndarray):
+    """Lattice heights and primitive outer normals of all facets in the order of poly.inequalities_list()"""
+    return lattice_heights(poly.inequalities_list())
+
+
+def facets_at_height(poly, k) -> List[int]:
+    """Indices of the facets of height k: <u, v> = k for the primitive outer normal u and all v on the facet"""
+    heights, _ = facet_heights(poly)
+    return [i for i, h in enumerate(heights) if h == k]
+
+
+def _denominators_lcm(row: List[Fraction]) -> int:
+    denominator = 1
+    for x in row:
+        denominator = denominator * x.denominator // gcd(denominator, x.denominator)
+    return denominator
+
+
+def _echelon(rows: List[List[Fraction]]) -> (List[List[Fraction]], List[int]):
+    # Reduced row echelon form and pivot columns
+    rows = [list(row) for row in rows]
+    pivots = []
+    r = 0
+    for col in range(len(rows[0]) if rows else 0):
+        pivot = next((i for i in range(r, len(rows)) if rows[i][col] != 0), None)
+        if pivot is None:
+            continue
+        rows[r], rows[pivot] = rows[pivot], rows[r]
+        lead = rows[r][col]
+        rows[r] = [x / lead for x in rows[r]]
+        for i in range(len(rows)):
+            if i != r and rows[i][col] != 0:
+                factor = rows[i][col]
+                rows[i] = [x - factor * y for x, y in zip(rows[i], rows[r])]
+        pivots.append(col)
+        r += 1
+    return rows[:r], pivots
+
+
+def rank(rows) -> int:
+    return len(_echelon([[to_fraction(x) for x in row] for row in rows])[1])
+
+
+def nullspace(rows, n: int) -> List[List[Fraction]]:
+    """Basis of the vectors x of length n with <row, x> = 0 for all rows"""
+    reduced, pivots = _echelon([[to_fraction(x) for x in row] for row in rows])
+    basis = []
+    for free in range(n):
+        if free in pivots:
+            continue
+        x = [Fraction(0)] * n
+        x[free] = Fraction(1)
+        for row, col in zip(reduced, pivots):
+            x[col] = -row[free]
+        basis.append(x)
+    return basis
+
+
+def inverse(rows) -> List[List[Fraction]]:
+    """Inverse of a square matrix, ZeroDivisionError if it is singular"""
+    n = len(rows)
+    extended = [[to_fraction(x) for x in row] + [Fraction(int(i == j)) for j in range(n)]
+                for i, row in enumerate(rows)]
+    reduced, pivots = _echelon(extended)
+    if pivots[:n] != list(range(n)):
+        raise ZeroDivisionError('matrix is singular')
+    return [row[n:] for row in reduced]
+
+
+def independent_rows(rows) -> List[int]:
+    """Indices of the first rows forming a basis of the span of all rows"""
+    columns = [list(column) for column in zip(*[[to_fraction(x) for x in row] for row in rows])]
+    return _echelon(columns)[1]
+
+
+def determinant(rows) -> Fraction:
+    rows = [[to_fraction(x) for x in row] for row in rows]
+    det = Fraction(1)
+    for col in range(len(rows)):
+        pivot = next((i for i in range(col, len(rows)) if rows[i][col] != 0), None)
+        if pivot is None:
+            return Fraction(0)
+        if pivot != col:
+            rows[col], rows[pivot] = rows[pivot], rows[col]
+            det = -det
+        det *= rows[col][col]
+        for i in range(col + 1, len(rows)):
+            factor = rows[i][col] / rows[col][col]
+            rows[i] = [x - factor * y for x, y in zip(rows[i], rows[col])]
+    return det
+
+
+def primitive(row: List[Fraction]) -> List[int]:
+    """Integer vector with coprime entries proportional to row with a positive factor"""
+    denominator = _denominators_lcm(row)
+    row = [int(x * denominator) for x in row]
+    g = 0
+    for x in row:
+        g = gcd(g, x)
+    return [x // g for x in row] if g else row
+
+
+class ExactPolytope:
+    """
+    Convex hull of finitely many rational points in exact arithmetic, for the low dimensions and
+    small numbers of vertices of CDPs. Hyperplanes through affinely independent points of the affine
+    hull are tried one by one, so the construction is polynomial for a fixed dimension.
+    Inequalities are rows [b, a_1, ..., a_n] of b + <a, x> >= 0 with coprime integers, equations
+    have the same form.
+    """
+    def __init__(self, vertices):
+        points = sorted({tuple(exact_number(x) for x in vert) for vert in vertices})
+        if not points:
+            raise ValueError('Polytope should have at least one vertex')
+        self._ambient_dim = len(points[0])
+        origin = points[0]
+        directions = [[to_fraction(x) - to_fraction(y) for x, y in zip(p, origin)] for p in points[1:]]
+        self._dim = rank(directions) if directions else 0
+        n = self._ambient_dim
+        self._equations = []
+        for normal in nullspace(directions, n) if directions else _unit_vectors(n):
+            a = primitive(normal)
+            self._equations.append([-sum(x * y for x, y in zip(a, origin))] + a)
+        self._inequalities = self._facet_inequalities(points)
+        # Vertices are the points where tight inequalities and equations define a single point
+        self._vertices = [p for p in points
+                          if rank([row[1:] for row in self._equations + self._tight(p)]) == n]
+        self._facets = [frozenset(i for i, v in enumerate(self._vertices) if _value(row, v) == 0)
+                        for row in self._inequalities]
+
+    def _facet_inequalities(self, points):
+        if self._dim == 0:
+            return []
+        equation_normals = [row[1:] for row in self._equations]
+        n = self._ambient_dim
+        rows = set()
+        for subset in combinations(points, self._dim):
+            directions = [[to_fraction(x) - to_fraction(y) for x, y in zip(p, subset[0])] for p in subset[1:]]
+            # Normals of equations span the complement of the affine hull, so the normal
+            # of the hyperplane lies in the hull and is unique if the points are independent
+            normals = nullspace(directions + equation_normals, n)
+            if len(normals) != 1:
+                continue
+            a = primitive(normals[0])
+            row = [-sum(to_fraction(x) * y for x, y in zip(subset[0], a))] + a
+            values = [_value(row, p) for p in points]
+            if all(v >= 0 for v in values):
+                rows.add(tuple(primitive(row)))
+            elif all(v <= 0 for v in values):
+                rows.add(tuple(primitive([-x for x in row])))
+        return [list(row) for row in sorted(rows)]
+
+    def _tight(self, point):
+        return [row for row in self._inequalities if _value(row, point) == 0]
+
+    def vertices_list(self) -> List[list]:
+        return [list(v) for v in self._vertices]
+
+    def vertices(self) -> List[tuple]:
+        return list(self._vertices)
+
+    def n_vertices(self) -> int:
+        return len(self._vertices)
+
+    def inequalities_list(self) -> List[list]:
+        return [list(row) for row in self._inequalities]
+
+    def equations_list(self) -> List[list]:
+        return [list(row) for row in self._equations]
+
+    def dim(self) -> int:
+        return self._dim
+
+    def ambient_dim(self) -> int:
+        return self._ambient_dim
+
+    def contains(self, point) -> bool:
+        point = [exact_number(x) for x in point]
+        return all(_value(row, point) >= 0 for row in self._inequalities) and \
+            all(_value(row, point) == 0 for row in self._equations)
+
+    def facet_vertex_sets(self) -> List[frozenset]:
+        return list(self._facets)
+
+    def edges(self) -> List[tuple]:
+        """Pairs of vertex indices, vertices are adjacent if the face of their common facets is an edge"""
+        if self._dim == 1:
+            return [(0, 1)]
+        edges = []
+        equation_normals = [row[1:] for row in self._equations]
+        for i, j in combinations(range(len(self._vertices)), 2):
+            common = [row[1:] for row, facet in zip(self._inequalities, self._facets) if i in facet and j in facet]
+            if rank(common + equation_normals) == self._ambient_dim - 1:
+                edges.append((i, j))
+        return edges
+
+    def __eq__(self, other):
+        if not hasattr(other, 'vertices_list'):
+            return NotImplemented
+        return same_polytope(self, other)
+
+    def __hash__(self):
+        return hash(tuple(self._vertices))
+
+    def __repr__(self):
+        return f'ExactPolytope({self.vertices_list()})'
+
+
+def _value(row, point):
+    return row[0] + sum(a * x for a, x in zip(row[1:], point))
+
+
+def _unit_vectors(n: int) -> List[List[Fraction]]:
+    return [[Fraction(int(i == j)) for j in range(n)] for i in range(n)]
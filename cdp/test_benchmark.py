@@ -0,0 +1,33 @@
+#!/usr/bin/env sage
+from random import Random
+from sage.all import *
+from benchmark import compare, equivalent_copy, random_cdp, run
+from cdp import CDP
+
+
+def test_random_cdp():
+    rng = Random(1)
+    cdp, psi_list, base = random_cdp(rng, 2, 6, 3, 2)
+    # validation does not fail
+    CDP(psi_list, base)
+    # psi are concave: every affine piece is not less than psi on the whole base
+    points = [list(v) for v in base.vertices_list()]
+    for psi in psi_list:
+        values = psi.values(points)[0]
+        for piece in psi.affine_pieces:
+            assert all(piece.coefs[0] + sum(a * x for a, x in zip(piece.coefs[1:], p)) >= value
+                       for p, value in zip(points, values))
+    assert cdp.equal(equivalent_copy(rng, cdp))
+
+
+def test_run():
+    report = run([2], [4], [2], [2], repeat=1)
+    names = {record['name'] for record in report['results']}
+    assert names == {'validate', 'generate', 'facet_is_at_height_one', 'facet_heights', 'is_fano', 'equal_equivalent',
+                     'equal_non_equivalent', 'value'}
+    assert all(record['result'] for record in report['results'] if record['name'] in ['equal_equivalent', 'is_fano'])
+    assert len(compare(report, report)) == len(report['results'])
+
+
+test_random_cdp()
+test_run()
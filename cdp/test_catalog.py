@@ -0,0 +1,62 @@
+#!/usr/bin/env sage
+import os
+import tempfile
+from fractions import Fraction
+from sage.all import *
+from catalog import CatalogReader, write_catalog
+from cdp import CDP, generate_cdp_from_polytope
+
+
+def _cdps():
+    poly1 = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0], [0, 0, -1]])
+    poly2 = Polyhedron(vertices=[[-2, 0], [0, 2], [1, 2], [2, 1], [2, -2], [-2, -2]])
+    return [generate_cdp_from_polytope(poly1), generate_cdp_from_polytope(poly2)]
+
+
+def _save_load(cdp: CDP) -> CDP:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cdp.cat')
+        cdp.save(path)
+        return CDP.load(path)
+
+
+def test_save_load():
+    cdp = _cdps()[0].sheared([1, -1], [Fraction(1, 2), 0])
+    loaded = _save_load(cdp)
+    assert loaded == cdp
+    assert sorted(loaded.psi_list[0].coefs[:, 1]) == sorted(cdp.psi_list[0].coefs[:, 1])
+    assert any(isinstance(x, Fraction) for x in loaded.psi_list[0].coefs.flat)
+
+
+def test_save_load_rational_domains():
+    cdp = _cdps()[0]
+    cdp.transform_base(linear_transformation(matrix(ZZ, [[2, 0], [0, 1]])))
+    assert any(isinstance(x, Fraction) for x in cdp.psi_list[0].inequalities.flat)
+    loaded = _save_load(cdp)
+    assert loaded == cdp
+    assert loaded.invariants() == cdp.invariants()
+    points = [[Fraction(1, 4), 0], [Fraction(-1, 2), Fraction(1, 4)], [0, 0]]
+    for psi, other in zip(cdp.psi_list, loaded.psi_list):
+        assert [psi.value(x) for x in points] == [other.value(x) for x in points]
+
+
+def test_catalog():
+    cdps = _cdps()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'catalog.cat')
+        assert write_catalog(path, cdps) == 2
+        reader = CatalogReader(path)
+        assert len(reader) == 2
+        assert reader.psi_sizes(1) == [len(psi) for psi in cdps[1].psi_list]
+        assert sorted(map(tuple, reader.base_vertices(1))) == \
+            sorted(map(tuple, cdps[1].base.vertices_list()))
+        for i, (cdp, loaded) in enumerate(zip(cdps, reader)):
+            assert reader.invariants(i) == cdp.invariants()
+            assert loaded == cdp
+            assert loaded.equal(cdp)
+        assert reader[-1] == cdps[1]
+
+
+test_save_load()
+test_save_load_rational_domains()
+test_catalog()
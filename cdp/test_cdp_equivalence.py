@@ -1,7 +1,11 @@
 #!/usr/bin/env sage
 from sage.all import *
+import numpy as np
+import os
+import tempfile
+from fractions import Fraction
 from piecewise_affine_function import AffineFunction, PiecewiseAffineFunction
-from cdp import CDP, generate_cdp_from_polytope
+from cdp import CDP, CDPTransformation, EqualStats, generate_cdp_from_polytope, _lattice_map_solver, _psi_assignment
 
 
 class TestCDPEquality:
@@ -69,7 +73,7 @@ class TestCDPEquality:
         cdp2.transform_base(phi)
         assert cdp1.equal(cdp2)
 
-    def test_list_mappings(self):
+    def test_psi_assignment(self):
         base1 = Polyhedron(vertices=[[1, 0], [0, -1], [-1, 0], [0, 1]])
         f_11 = AffineFunction([1, -1, -1], Polyhedron(vertices=[[0, 0], [1, 0], [0, 1]]))
         f_12 = AffineFunction([1, -1, 1], Polyhedron(vertices=[[0, 0], [1, 0], [0, -1]]))
@@ -81,9 +85,65 @@ class TestCDPEquality:
         f_23 = AffineFunction([1, 1, -1], Polyhedron(vertices=[[0, 0], [-1, 0], [0, 1]]))
         f_2 = PiecewiseAffineFunction([f_21, f_22, f_23])
         cdp = CDP([f_1, f_2], base1)
-        classes = [[0, 1, 2], [0, 1, 2], [0, 1, 2], [3, 4], [3, 4]]
-        res = cdp._list_mappings(classes)
-        assert False
+        other = cdp.sheared([1, -1], [1, 1]).translated([2, -2])
+        assert _psi_assignment(cdp.psi_list, other.psi_list) == [0, 1]
+        assert _psi_assignment(cdp.psi_list, other.psi_list[::-1]) == [1, 0]
+        other = cdp.sheared([1, -1], [1, 1])
+        other.psi_list[0] = other.psi_list[0].sheared([0, 1])
+        assert _psi_assignment(cdp.psi_list, other.psi_list) is None
+
+    def test_psi_assignment_same_domains(self):
+        base = Polyhedron(vertices=[[-1], [1]])
+        f = PiecewiseAffineFunction([AffineFunction([1, 0], base)])
+        g = PiecewiseAffineFunction([AffineFunction([2, 0], base)])
+        h = PiecewiseAffineFunction([AffineFunction([0, 0], base)])
+        # Constants 1, 1, 1 can only be translated to 2, 0, 1 with zero sum of alphas
+        assert sorted(_psi_assignment([f, f, f], [g, h, f])) == [0, 1, 2]
+        assert _psi_assignment([f, f, f], [g, g, h]) is None
+        half = PiecewiseAffineFunction([AffineFunction([Fraction(1, 2), 0], base)])
+        assert _psi_assignment([f, f], [half, f.translated(Fraction(1, 2))]) is None
+
+    def test_vertex_maps(self):
+        base = Polyhedron(vertices=[[1, 0], [0, -1], [-1, 0], [0, 1]])
+        f = PiecewiseAffineFunction([AffineFunction([1, 0, 0], base)])
+        cdp1 = CDP([f, deepcopy(f)], base)
+        # Square has 8 symmetries
+        assert len(list(cdp1._vertex_maps(cdp1))) == 8
+        base2 = Polyhedron(vertices=[[1, 0], [0, -1], [-1, 0], [0, 2], [1, 1]])
+        g = PiecewiseAffineFunction([AffineFunction([1, 0, 0], base2)])
+        cdp2 = CDP([g, deepcopy(g)], base2)
+        assert len(list(cdp1._vertex_maps(cdp2))) == 0
+
+    def test_base_automorphisms(self):
+        base = Polyhedron(vertices=[[1, 0], [0, -1], [-1, 0], [0, 1]])
+        f = PiecewiseAffineFunction([AffineFunction([1, 0, 0], base)])
+        cdp1 = CDP([f, deepcopy(f)], base)
+        group = cdp1.base_automorphisms()
+        assert len(group) == 8
+        assert group[0].tolist() == [[1, 0], [0, 1]]
+        cdp2 = deepcopy(cdp1)
+        cdp2.transform_base(linear_transformation(matrix(ZZ, [[1, 1], [0, 1]])))
+        # Integer matrices act on columns, Sage linear transformations on rows
+        cdp3 = deepcopy(cdp1)
+        cdp3.transform_base(matrix(ZZ, [[1, 0], [1, 1]]))
+        assert sorted(map(tuple, cdp3.base.vertices_list())) == sorted(map(tuple, cdp2.base.vertices_list()))
+        assert cdp3.psi_list == cdp2.psi_list
+        # Group of the same base is taken from the cache
+        assert CDP([f], base).base_automorphisms() is group
+        maps = list(cdp1._lattice_maps(cdp2))
+        assert len({tuple(map(tuple, M.tolist())) for M in maps}) == 8
+        vertices = sorted(map(tuple, cdp2.base.vertices_list()))
+        for M in maps:
+            assert sorted(tuple(np.matmul(M, v).tolist()) for v in base.vertices_list()) == vertices
+
+    def test_lattice_map_solver(self):
+        solve = _lattice_map_solver([[1, 0], [0, 1], [-1, -1]])
+        M = solve([[1, 0], [1, 1], [-2, -1]])
+        assert M.tolist() == [[1, 1], [0, 1]]
+        # Determinant 2
+        assert solve([[2, 0], [0, 1], [-2, -1]]) is None
+        # Not a linear map
+        assert solve([[1, 0], [0, 1], [1, 1]]) is None
 
     def test_on_thoric_variety(self):
         poly = Polyhedron(vertices=[[-2, 0], [0, 2], [1, 2], [2, 1], [2, -2], [-2, -2]])
@@ -105,6 +165,69 @@ class TestCDPEquality:
         cdp2.transform_base(phi)
         assert cdp.equal(cdp2)
 
+    def test_parallel_equal(self):
+        poly = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0],
+                                    [0, 0, -1]])
+        cdp = generate_cdp_from_polytope(poly)
+        cdp2 = deepcopy(cdp)
+        cdp2.shear([-2, 2], [2, 2])
+        cdp2.translate([-3, 3])
+        phi = linear_transformation(matrix(ZZ, [[-1, 0], [0, 1]]))
+        cdp2.transform_base(phi)
+        assert cdp.equal(cdp2, workers=2)
+        poly3 = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 2], [-1, 0, 0],
+                                     [0, 0, -1]])
+        cdp3 = generate_cdp_from_polytope(poly3)
+        assert not cdp.equal(cdp3, workers=2)
+
+    def test_equivalence_witness(self):
+        poly = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0],
+                                    [0, 0, -1]])
+        cdp = generate_cdp_from_polytope(poly)
+        cdp2 = deepcopy(cdp)
+        cdp2.translate([-3, 3])
+        phi = linear_transformation(matrix(ZZ, [[1, 1], [0, 1]]))
+        cdp2.transform_base(phi)
+        witness, mapping = cdp.equivalence_witness(cdp2)
+        assert witness.base == cdp2.base
+        assert len(mapping) == 2
+        poly3 = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 2], [-1, 0, 0],
+                                     [0, 0, -1]])
+        assert cdp.equivalence_witness(generate_cdp_from_polytope(poly3)) is None
+
+    def test_normal_form(self):
+        poly = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0],
+                                    [0, 0, -1]])
+        cdp = generate_cdp_from_polytope(poly)
+        cdp2 = deepcopy(cdp)
+        cdp2.shear([-2, 2], [2, 2])
+        cdp2.translate([-3, 3])
+        phi = linear_transformation(matrix(ZZ, [[0, 1], [1, 0]]))
+        cdp2.transform_base(phi)
+        assert cdp.normal_form() == cdp2.normal_form()
+        assert cdp.canonical_hash() == cdp2.canonical_hash()
+        poly3 = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 2], [-1, 0, 0],
+                                     [0, 0, -1]])
+        cdp3 = generate_cdp_from_polytope(poly3)
+        assert cdp.canonical_hash() != cdp3.canonical_hash()
+
+    def test_canonical_hash_of_derived_cdps(self):
+        poly = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]])
+        cdp = generate_cdp_from_polytope(poly)
+        skew = CDPTransformation(2, 2)
+        skew.transform_base([[1, 1], [0, 1]])
+        skew.shear([1, -1], [0, 1])
+        transformed = deepcopy(cdp)
+        transformed.transform_base(linear_transformation(matrix(ZZ, [[1, 1], [0, 1]])))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cdp.cat')
+            cdp.transformed(skew).save(path)
+            loaded = CDP.load(path)
+        derived = [cdp.transformed(CDPTransformation(2, 2)), cdp.transformed(skew), transformed, loaded]
+        for other in derived:
+            assert other.normal_form() == cdp.normal_form()
+            assert other.canonical_hash() == cdp.canonical_hash()
+
     def test_many_functions(self):
         base1 = Polyhedron(vertices=[[-1], [1]])
         # y = 1 + x, x \in [-1, 0]
@@ -123,12 +246,103 @@ class TestCDPEquality:
         cdp2.translate([-2, 1, 1])
         assert cdp1.equal(cdp2)
 
+    def test_same_domains(self):
+        base = Polyhedron(vertices=[[-1], [1]])
+        f = PiecewiseAffineFunction([AffineFunction([1, 1], Polyhedron(vertices=[[-1], [0]])),
+                                     AffineFunction([1, -1], Polyhedron(vertices=[[0], [1]]))])
+        g = PiecewiseAffineFunction([AffineFunction([2, 2], Polyhedron(vertices=[[-1], [0]])),
+                                     AffineFunction([2, -2], Polyhedron(vertices=[[0], [1]]))])
+        # 12! mappings of psi with the same domains, only 6! * 6! of them are compatible
+        cdp1 = CDP([deepcopy(f) for _ in range(6)] + [deepcopy(g) for _ in range(6)], base)
+        cdp2 = deepcopy(cdp1)
+        cdp2.psi_list.reverse()
+        alpha = [i - 3 for i in range(11)]
+        cdp2.translate(alpha + [-sum(alpha)])
+        cdp2.shear([1, -1] * 6, [1])
+        assert cdp1.equal(cdp2)
+        cdp3 = deepcopy(cdp1)
+        cdp3.translate([5] + [-1] * 5 + [0] * 6)
+        assert cdp1.equal(cdp3)
+        # Constants sum to 0, but the shear vectors do not
+        cdp3.psi_list[0] = cdp3.psi_list[0].sheared([1])
+        stats = EqualStats()
+        assert not cdp1.equal(cdp3, stats=stats)
+        assert stats.counts['shifts_nonzero'] > 0
+        cdp3.psi_list[1] = cdp3.psi_list[1].sheared([-1])
+        assert cdp1.equal(cdp3)
+
+    def test_equal_stats(self):
+        poly = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0],
+                                    [0, 0, -1]])
+        cdp = generate_cdp_from_polytope(poly)
+        cdp2 = deepcopy(cdp)
+        cdp2.translate([-3, 3])
+        cdp2.transform_base(linear_transformation(matrix(ZZ, [[-1, 0], [0, 1]])))
+        stats = EqualStats()
+        assert cdp.equal(cdp2, stats=stats)
+        assert stats.counts['mappings'] == 1
+        assert stats.counts['vertex_maps'] == stats.counts['lattice_maps'] + stats.counts['non_unimodular']
+        assert stats.counts['lattice_maps'] >= 1
+        assert stats.times['base_combinatorics'] > 0
+        poly3 = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 2], [-1, 0, 0],
+                                     [0, 0, -1]])
+        stats = EqualStats()
+        assert not cdp.equal(generate_cdp_from_polytope(poly3), stats=stats)
+        assert stats.counts['mappings'] == 0
+        assert stats.counts['class_splits_failed'] + stats.counts['shifts_nonzero'] + \
+            stats.counts['pairs_rejected'] > 0
+
+    def test_invariants_prefilter(self):
+        poly = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0],
+                                    [0, 0, -1]])
+        cdp = generate_cdp_from_polytope(poly)
+        cdp2 = deepcopy(cdp)
+        cdp2.shear([-2, 2], [2, 2])
+        cdp2.transform_base(linear_transformation(matrix(ZZ, [[1, 1], [0, 1]])))
+        assert cdp.invariants() == cdp2.invariants()
+        # base of 3 vertices with normalized volume 2 and 4 lattice points, domains of volume 1
+        assert cdp.invariants() == (3, (1, 3, 3, 1), 2, (2, 2), 4, ((1, 1), (1, 1)), (2,))
+        cdp3 = generate_cdp_from_polytope(Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [-1, -1, 0],
+                                                                [0, 0, 1], [0, 0, -1]]))
+        cdp4 = generate_cdp_from_polytope(Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [-1, -1, 0],
+                                                                [0, 0, 1], [1, 0, -1]]))
+        assert cdp4.invariants() == (3, (1, 3, 3, 1), 3, (1, 3), 4, ((1, 1, 1), (3,)), (1, 1))
+        stats = EqualStats()
+        assert not cdp3.equal(cdp4, stats=stats)
+        assert stats.counts['invariants_rejected'] == 1
+        assert stats.counts['vertex_maps'] == 0
+
+    def test_invariants_after_transform(self):
+        base = Polyhedron(vertices=[[1, 0], [0, -1], [-1, 0], [0, 1]])
+        f = PiecewiseAffineFunction([AffineFunction([1, 0, 0], base)])
+        cdp1 = CDP([f, deepcopy(f)], base)
+        cdp2 = deepcopy(cdp1)
+        invariants = cdp1.invariants()
+        # Volume and lattice points of the base change under a map of determinant 2
+        phi = linear_transformation(matrix(ZZ, [[1, 1], [-1, 1]]))
+        cdp1.transform_base(phi)
+        cdp2.transform_base(phi)
+        assert cdp1.invariants() != invariants
+        assert cdp1.equal(cdp2)
+
 
 test = TestCDPEquality()
 # test.test_1d_equal()
 # test.test_1d_not_equal()
 # test.test_2d_equal()
-# test.test_list_mappings()
+test.test_vertex_maps()
+test.test_base_automorphisms()
+test.test_psi_assignment()
+test.test_psi_assignment_same_domains()
+test.test_lattice_map_solver()
 test.test_on_thoric_variety()
 test.test_on_2d_thoric_variety()
-test.test_many_functions()
\ No newline at end of file
+test.test_many_functions()
+test.test_same_domains()
+test.test_normal_form()
+test.test_canonical_hash_of_derived_cdps()
+test.test_parallel_equal()
+test.test_equivalence_witness()
+test.test_equal_stats()
+test.test_invariants_prefilter()
+test.test_invariants_after_transform()
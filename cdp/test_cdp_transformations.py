@@ -1,7 +1,7 @@
 #!/usr/bin/env sage
 from sage.all import *
 from piecewise_affine_function import AffineFunction, PiecewiseAffineFunction
-from cdp import CDP
+from cdp import CDP, CDPTransformation
 
 
 # TODO: remove copy-paste polyhedron
@@ -58,6 +58,60 @@ class TestCDPTransform:
         assert domain_verts == [[0], [1]]
         assert cdp.psi_list[1].affine_pieces[0].coefs == [-0.5, 0.5]
 
+    def test_recorded_transformation(self):
+        base = Polyhedron(vertices=[[1, 0], [0, -1], [-1, 0], [0, 1]])
+        f_11 = AffineFunction([1, -1, -1], Polyhedron(vertices=[[0, 0], [1, 0], [0, 1]]))
+        f_12 = AffineFunction([1, -1, 1], Polyhedron(vertices=[[0, 0], [1, 0], [0, -1]]))
+        f_13 = AffineFunction([1, 1, -1], Polyhedron(vertices=[[0, 0], [-1, 0], [0, 1]]))
+        f_14 = AffineFunction([1, 1, 1], Polyhedron(vertices=[[0, 0], [-1, 0], [0, -1]]))
+        f_1 = PiecewiseAffineFunction([f_11, f_12, f_13, f_14])
+        f_2 = PiecewiseAffineFunction([AffineFunction([1, 0, 0], base)])
+        cdp = CDP([f_1, f_2], base)
+        skew = linear_transformation(matrix(ZZ, [[1, 1], [0, 1]]))
+        rotation = linear_transformation(matrix(ZZ, [[0, -1], [1, 0]]))
+        steps = [('shear', ([1, -1], [1, 2])), ('transform_base', (skew,)), ('translate', ([3, -3],)),
+                 ('transform_base', (rotation,)), ('shear', ([-2, 2], [0, 1]))]
+        expected = deepcopy(cdp)
+        transformation = CDPTransformation(2, 2)
+        for name, args in steps:
+            getattr(expected, name)(*args)
+            getattr(transformation, name)(*args)
+        assert cdp.transformed(transformation) == expected
+        assert cdp.transformed(transformation).transformed(transformation.inverse()) == cdp
+        # cdp is not changed
+        assert cdp.psi_list[1].affine_pieces[0].coefs == [1, 0, 0]
+        half = CDPTransformation(2, 2)
+        for name, args in steps[:2]:
+            getattr(half, name)(*args)
+        rest = CDPTransformation(2, 2)
+        for name, args in steps[2:]:
+            getattr(rest, name)(*args)
+        assert cdp.transformed(half.then(rest)) == expected
+        assert expected.transformed(rest.inverse()) == cdp.transformed(half)
+
+    def test_shared_parts(self):
+        base = Polyhedron(vertices=[[-1], [1]])
+        f_1 = PiecewiseAffineFunction([AffineFunction([1, 1], Polyhedron(vertices=[[-1], [0]])),
+                                       AffineFunction([1, -1], Polyhedron(vertices=[[0], [1]]))])
+        f_2 = PiecewiseAffineFunction([AffineFunction([1, 0], base)])
+        f_3 = PiecewiseAffineFunction([AffineFunction([0, 1], base)])
+        cdp = CDP([f_1, f_2, f_3], base)
+        translated = cdp.translated([2, -2, 0])
+        assert translated.base is cdp.base
+        assert translated.psi_list[2] is f_3
+        assert translated.psi_list[0].vertices is f_1.vertices
+        assert translated.psi_list[0].affine_pieces[0].coefs == [3, 1]
+        assert f_1.affine_pieces[0].coefs == [1, 1]
+        sheared = translated.sheared([1, 0, -1], [2])
+        assert sheared.psi_list[1] is translated.psi_list[1]
+        assert sheared.psi_list[2].affine_pieces[0].coefs == [0, -1]
+        # Changes in place replace psi and do not reach CDPs sharing them
+        sheared.translate([0, 1, -1])
+        sheared.transform_base(linear_transformation(matrix(ZZ, [[-1]])))
+        assert translated.psi_list[1].affine_pieces[0].coefs == [-1, 0]
+        assert cdp.psi_list[1] is f_2 and f_2.affine_pieces[0].coefs == [1, 0]
+        assert sheared.psi_list[1].affine_pieces[0].coefs == [0, 0]
+
     def test_2d_shear(self):
         base1 = Polyhedron(vertices=[[1, 0], [0, -1], [-1, 0], [0, 1]])
         f_11 = AffineFunction([1, -1, -1], Polyhedron(vertices=[[0, 0], [1, 0], [0, 1]]))
@@ -81,4 +135,6 @@ test = TestCDPTransform()
 test.test_1d_shear()
 test.test_1d_translate()
 test.test_1d_transform_base()
+test.test_recorded_transformation()
+test.test_shared_parts()
 test.test_2d_shear()
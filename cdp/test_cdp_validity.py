@@ -33,6 +33,19 @@ class TestCDPValidity:
         else:
             assert True
 
+    def test_skip_validation(self):
+        base = Polyhedron(vertices=[[-1], [1]])
+        f_1 = PiecewiseAffineFunction([AffineFunction([-1, 0], Polyhedron(vertices=[[-1], [1]]))])
+        f_2 = PiecewiseAffineFunction([AffineFunction([0, 1], Polyhedron(vertices=[[-1], [1]]))])
+        try:
+            CDP([f_1, f_2], base)
+        except ValueError:
+            pass
+        else:
+            assert False
+        cdp = CDP([f_1, f_2], base, validate=False)
+        assert cdp.k == 2
+
     def test_equality(self):
         base = Polyhedron(vertices=[[-1], [1]])
         f_11 = AffineFunction([1, 1], Polyhedron(vertices=[[-1], [0]]))
@@ -67,5 +80,6 @@ class TestCDPValidity:
 test = TestCDPValidity()
 test.test_valid_cdp()
 test.test_not_valid_cdp()
+test.test_skip_validation()
 test.test_equality()
 test.test_inequality()
@@ -0,0 +1,28 @@
+#!/usr/bin/env sage
+from sage.all import *
+from cdp import generate_cdp_from_polytope
+from classify import classify
+
+
+class TestClassify:
+
+    def test_classify(self):
+        poly = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0],
+                                    [0, 0, -1]])
+        cdp1 = generate_cdp_from_polytope(poly)
+        cdp2 = deepcopy(cdp1)
+        cdp2.shear([-2, 2], [2, 2])
+        cdp2.translate([-3, 3])
+        poly3 = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 2], [-1, 0, 0],
+                                     [0, 0, -1]])
+        cdp3 = generate_cdp_from_polytope(poly3)
+        poly4 = Polyhedron(vertices=[[-2, 0], [0, 2], [1, 2], [2, 1], [2, -2], [-2, -2]])
+        cdp4 = generate_cdp_from_polytope(poly4)
+        classes, reports = classify([cdp1, cdp3, cdp2, cdp4])
+        assert sorted(classes) == [[0, 2], [1], [3]]
+        assert sum(r.size for r in reports) == 4
+        assert sum(r.classes for r in reports) == 3
+
+
+test = TestClassify()
+test.test_classify()
@@ -1,6 +1,7 @@
 #!/usr/bin/env sage
 from sage.all import *
-from cdp import facet_is_at_height_one
+from cdp import facet_is_at_height_one, generate_cdp_from_polytope
+from polytope import facet_heights, facets_at_height, polytope
 
 
 def test_facet_height_one():
@@ -14,11 +15,51 @@ def test_facet_height_one_3d():
     assert facet_is_at_height_one(p.facets()[0].vertices()) is True
 
 
+def test_facet_height_one_rectangle():
+    p = Polyhedron(vertices=[[0, 1], [0, -1], [2, 1], [2, -1]])
+    assert facet_is_at_height_one(p.facets()[0].vertices()) is True
+
+
 def test_facet_not_height_one():
     p = Polyhedron(vertices=[[2, 0], [0, 2], [-2, 0], [0, -2]])
     assert facet_is_at_height_one(p.facets()[1].vertices()) is False
 
 
+def test_facet_through_origin():
+    assert facet_is_at_height_one([[0, 0], [1, 1]]) is False
+    # first three vertices are linearly dependent
+    assert facet_is_at_height_one([[1, 0, 0], [2, -1, 0], [0, 1, 0], [0, 0, 1]]) is True
+    assert facet_is_at_height_one([[2, 0, 0], [2, 1, 0], [2, 0, 1]]) is False
+
+
+def test_facet_heights():
+    p = polytope([[2, 0], [0, 1], [-1, 0], [0, -1]])
+    heights, normals = facet_heights(p)
+    rows = sorted(zip(heights, map(tuple, normals.tolist())))
+    assert rows == [(1, (-1, -1)), (1, (-1, 1)), (2, (1, -2)), (2, (1, 2))]
+    assert len(facets_at_height(p, 1)) == 2
+    assert len(facets_at_height(p, 2)) == 2
+    assert facets_at_height(Polyhedron(vertices=[[0, 0], [1, 0], [0, 1]]), 0) != []
+
+
+def test_octahedron_is_fano():
+    p = Polyhedron(vertices=[[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]])
+    assert generate_cdp_from_polytope(p).is_fano() is True
+
+
+def test_not_fano():
+    p = Polyhedron(vertices=[[2, 0, 0], [0, 2, 0], [0, 0, 2], [-2, 0, 0], [0, -2, 0], [0, 0, -2]])
+    assert generate_cdp_from_polytope(p).is_fano() is False
+    # 0 is not in the interior of the base
+    p = Polyhedron(vertices=[[0, 1], [0, -1], [2, 1], [2, -1]])
+    assert generate_cdp_from_polytope(p).is_fano() is False
+
+
 test_facet_height_one()
 test_facet_height_one_3d()
-test_facet_not_height_one()
\ No newline at end of file
+test_facet_height_one_rectangle()
+test_facet_not_height_one()
+test_facet_through_origin()
+test_facet_heights()
+test_octahedron_is_fano()
+test_not_fano()
@@ -24,7 +24,16 @@ def test_generate_cdp_square():
     # assert False
 
 
-test_generate_cdp_pyramid()
-test_generate_cdp_square()
+def test_generate_cdp_origin_facets():
+    # Facets through the origin used to make the plane equations unsolvable
+    poly = Polyhedron(vertices=[[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    cdp = generate_cdp_from_polytope(poly)
+    domain = Polyhedron(vertices=[[0, 0], [1, 0], [0, 1]])
+    f = PiecewiseAffineFunction([AffineFunction(coefficients=[1, -1, -1], domain=domain)])
+    g = PiecewiseAffineFunction([AffineFunction(coefficients=[0, 0, 0], domain=domain)])
+    assert cdp == CDP(base=domain, psi_list=[f, g])
 
 
+test_generate_cdp_pyramid()
+test_generate_cdp_square()
+test_generate_cdp_origin_facets()
@@ -1,5 +1,7 @@
 #!/usr/bin/env sage
 from sage.all import *
+import numpy as np
+from fractions import Fraction
 
 from piecewise_affine_function import AffineFunction, PiecewiseAffineFunction
 
@@ -40,8 +42,95 @@ class TestPiecewiseAffineFunctionStr:
         assert not f == g
 
 
+class TestPiecewiseAffineFunctionArrays:
+
+    def test_packed(self):
+        f_1 = AffineFunction([1, -1, -1], Polyhedron(vertices=[[0, 0], [1, 0], [0, 1]]))
+        f_2 = AffineFunction([1, 1, -1], Polyhedron(vertices=[[0, 0], [-1, 0], [0, 1]]))
+        f = PiecewiseAffineFunction([f_1, f_2])
+        assert f.coefs.shape == (2, 3)
+        assert f.piece_vertices(1).tolist() == [[-1, 0], [0, 0], [0, 1]]
+        assert len(f.piece_inequalities(0)) == 3
+        assert f.value([-1, 0]) == 0
+        assert f.value([1, 0]) == 0
+        try:
+            f.value([1, 1])
+        except ValueError:
+            pass
+        else:
+            assert False
+
+    def test_values(self):
+        f_1 = AffineFunction([1, -1, -1], Polyhedron(vertices=[[0, 0], [1, 0], [0, 1]]))
+        f_2 = AffineFunction([1, 1, -1], Polyhedron(vertices=[[0, 0], [-1, 0], [0, 1]]))
+        f = PiecewiseAffineFunction([f_1, f_2])
+        points = np.array([[0, 0], [-1, 0], [1, 1], [0, 1], [1 / 2, 0]], dtype=object)
+        values, defined = f.values(points)
+        assert f.locate(points).tolist() == [0, 1, -1, 0, 0]
+        assert defined.tolist() == [True, True, False, True, True]
+        assert values.tolist() == [1, 0, 0, 0, 1 / 2]
+
+    def test_index(self):
+        pieces = []
+        for i in range(6):
+            for j in range(6):
+                square = Polyhedron(vertices=[[i, j], [i + 1, j], [i, j + 1], [i + 1, j + 1]])
+                pieces.append(AffineFunction([i + j, 0, 0], square))
+        f = PiecewiseAffineFunction(pieces)
+        points = np.array([[0, 0], [3, 2], [5, 6], [6, 6], [7, 0], [-1, 2]])
+        assert f.index().candidates(points[1]) == [13, 14, 19, 20]
+        assert f._locate_indexed(points).tolist() == f._locate_all(points).tolist()
+        assert f.locate(points).tolist() == [0, 13, 29, 35, -1, -1]
+        f = f.transformed(np.array([[-1, 0], [0, 1]]), np.array([[-1, 0], [0, 1]]))
+        assert f.locate(np.array([[-3, 2]])).tolist() == [13]
+
+    def test_fingerprint(self):
+        f_1 = AffineFunction([1, 1], Polyhedron(vertices=[[-1], [0]]))
+        f_2 = AffineFunction([1, -1], Polyhedron(vertices=[[0], [1]]))
+        f = PiecewiseAffineFunction([f_1, f_2])
+        g_1 = AffineFunction([2, 1], Polyhedron(vertices=[[-1], [0]]))
+        g_2 = AffineFunction([0, -1], Polyhedron(vertices=[[0], [1]]))
+        g = PiecewiseAffineFunction([g_2, g_1])
+        assert f.domain_fingerprints() == (((-1,), (0,)), ((0,), (1,)))
+        assert f.fingerprint() == g.fingerprint()
+        assert f._domains_mapping(g) == [1, 0]
+        assert f.can_be_translated(g) == (False, 0)
+        assert f.affine_class()[0] != g.affine_class()[0]
+        h = f.translated(2).sheared([-3])
+        assert h.affine_class()[0] == f.affine_class()[0]
+        assert (h.affine_class()[1] - f.affine_class()[1]).tolist() == [2, -3]
+        h = h.translated(Fraction(1, 2))
+        assert h.affine_class()[0] != f.affine_class()[0]
+
+    def test_transform(self):
+        f_1 = AffineFunction([1, -1, -1], Polyhedron(vertices=[[0, 0], [1, 0], [0, 1]]))
+        f = PiecewiseAffineFunction([f_1])
+        g = f.translated(2).sheared([1, 0])
+        assert f.affine_pieces[0].coefs == [1, -1, -1]
+        f = g
+        assert f.affine_pieces[0].coefs == [3, 0, -1]
+        # (x, y) -> (x + y, y)
+        M = np.array([[1, 1], [0, 1]])
+        f = f.transformed(M, np.array([[1, -1], [0, 1]]))
+        assert f.piece_vertices(0).tolist() == [[0, 0], [1, 0], [1, 1]]
+        # 3 - y
+        assert f.value([1, 1]) == 2
+        assert f.affine_pieces[0].domain == Polyhedron(vertices=[[0, 0], [1, 0], [1, 1]])
+        g = f.transformed(np.array([[-1, 0], [0, 1]]), np.array([[-1, 0], [0, 1]]))
+        assert g.piece_vertices(0).tolist() == [[-1, 0], [-1, 1], [0, 0]]
+        assert f.piece_vertices(0).tolist() == [[0, 0], [1, 0], [1, 1]]
+        assert f.affine_pieces[0].coefs == [3, 0, -1]
+
+
 test = TestPiecewiseAffineFunctionStr()
 test.test_1_piece()
 test.test_2_pieces()
 test.test_equality()
 test.test_inequality()
+
+test_arrays = TestPiecewiseAffineFunctionArrays()
+test_arrays.test_packed()
+test_arrays.test_values()
+test_arrays.test_index()
+test_arrays.test_fingerprint()
+test_arrays.test_transform()
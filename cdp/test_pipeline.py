@@ -0,0 +1,50 @@
+#!/usr/bin/env sage
+import json
+import os
+import tempfile
+from sage.all import *
+import pipeline
+from pipeline import lattice_polytopes_in_box, run
+
+
+def test_lattice_polytopes_in_box():
+    # 84 triples of points of 3x3 square without 8 collinear ones
+    assert len(list(lattice_polytopes_in_box(2, 1, 3))) == 76
+    serial = list(lattice_polytopes_in_box(2, 1, 4, chunk_size=16))
+    assert list(lattice_polytopes_in_box(2, 1, 4, processes=2, chunk_size=16)) == serial
+
+
+def test_run():
+    octahedron = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]]
+    sheared = [[1, 0, 1], [0, 1, 0], [0, 0, 1], [-1, 0, -1], [0, -1, 0], [0, 0, -1]]
+    big = [[2 * x for x in vert] for vert in octahedron]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'out.jsonl')
+        counts = run([octahedron, sheared, big], path, processes=2, batch_size=2)
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+    assert counts == {'polytopes': 3, 'errors': 0, 'fano': 2, 'classes': 2}
+    assert len(records) == 3
+
+
+def test_run_without_sage():
+    available = pipeline.sage_available
+    pipeline.sage_available = lambda: False
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.jsonl')
+            try:
+                run([[[1, 0], [0, 1], [-1, -1]]], path, processes=1)
+            except RuntimeError:
+                pass
+            else:
+                assert False
+            assert not os.path.exists(path)
+    finally:
+        pipeline.sage_available = available
+
+
+if __name__ == '__main__':
+    test_lattice_polytopes_in_box()
+    test_run()
+    test_run_without_sage()
@@ -0,0 +1,80 @@
+#!/usr/bin/env sage
+from sage.all import *
+import numpy as np
+from fractions import Fraction
+from polytope import ExactPolytope, adjacency_map, exact_number, facet_vertex_sets, get_backend, polytope, \
+    set_backend
+from piecewise_affine_function import AffineFunction, PiecewiseAffineFunction
+from cdp import CDP
+
+
+class TestExactPolytope:
+
+    def check_like_sage(self, points):
+        exact = ExactPolytope(points)
+        poly = Polyhedron(vertices=points)
+        assert exact.vertices_list() == sorted(poly.vertices_list())
+        assert exact.dim() == poly.dim()
+        assert exact == poly
+
+        def facets(p):
+            vertices = p.vertices_list()
+            return sorted(sorted(tuple(vertices[i]) for i in f) for f in facet_vertex_sets(p))
+
+        def edges(p):
+            vertices = p.vertices_list()
+            adjacency = adjacency_map(p)
+            return sorted(sorted([tuple(vertices[i]), tuple(vertices[j])]) for i in adjacency for j in adjacency[i])
+        assert facets(exact) == facets(poly)
+        assert edges(exact) == edges(poly)
+
+    def test_like_sage(self):
+        self.check_like_sage([[0, 0], [2, 0], [0, 2], [1, 1], [1, 0]])
+        self.check_like_sage([[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0], [0, -1, 0], [0, 0, -1], [0, 0, 0]])
+        # lower dimensional
+        self.check_like_sage([[0, 0, 0], [1, 1, 1], [2, 0, 2], [1, 0, 1]])
+        self.check_like_sage([[1, 2]])
+
+    def test_h_representation(self):
+        square = ExactPolytope([[0, 0], [0, 2], [2, 0], [2, 2], [1, 1]])
+        assert square.inequalities_list() == [[0, 0, 1], [0, 1, 0], [2, -1, 0], [2, 0, -1]]
+        assert square.contains([1, 2]) and not square.contains([3, 1])
+        segment = ExactPolytope([[0, 0], [2, 2]])
+        assert segment.equations_list() == [[0, 1, -1]] or segment.equations_list() == [[0, -1, 1]]
+        assert segment.contains([1, 1]) and not segment.contains([1, 0])
+
+    def test_exact_number(self):
+        for c, want in [(np.int64(3), 3), (ZZ(-2), -2), (QQ(4) / 2, 2), (Fraction(np.int64(4), np.int64(2)), 2),
+                        (np.float64(0.5), Fraction(1, 2)), (QQ(1) / 3, Fraction(1, 3))]:
+            x = exact_number(c)
+            assert x == want and type(x) is type(want)
+        assert type(exact_number(np.int64(3) / 2).numerator) is int
+
+    def test_cdp_without_sage_objects(self):
+        backend = get_backend()
+        set_backend('exact')
+        try:
+            base = polytope([[-1, 0], [1, 0], [0, 1], [0, -1]])
+            assert isinstance(base, ExactPolytope)
+            f = PiecewiseAffineFunction([AffineFunction([1, 0, 0], polytope([[-1, 0], [0, 1], [1, 0]])),
+                                         AffineFunction([1, 0, 1], polytope([[-1, 0], [0, -1], [1, 0]]))])
+            g = PiecewiseAffineFunction([AffineFunction([0, 0, 0], base)])
+            cdp = CDP([f, g], base)
+            other = deepcopy(cdp)
+            other.transform_base([[0, 1], [1, 0]])
+            other.translate([1, -1])
+            assert cdp.equal(other)
+            set_backend('sage')
+            other = deepcopy(cdp)
+            other.transform_base([[-1, 0], [0, 1]])
+            assert isinstance(other.base, type(Polyhedron(vertices=[[0]])))
+            assert cdp.equal(other)
+        finally:
+            set_backend(backend)
+
+
+test = TestExactPolytope()
+test.test_like_sage()
+test.test_h_representation()
+test.test_exact_number()
+test.test_cdp_without_sage_objects()